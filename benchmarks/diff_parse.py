@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Benchmark for the diff parser of the file module.
+
+Parses a synthetic diff with the current parser and with a copy of the parser
+it replaced (which created a namedtuple class per call, searched every line
+with an uncompiled regex and created a lambda per hunk), and reports the time
+and (on Python 3) the peak memory each takes. It also checks that both produce
+the same output.
+
+Usage: python benchmarks/diff_parse.py [lines] [runs]
+"""
+
+
+from __future__ import print_function
+
+import collections
+import os
+import re
+import sys
+import time
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None  # Python 2.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitpylib import file as git_file
+
+
+def main():
+  n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+  runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+  diff_out = _make_diff(n)
+
+  if [tuple(l) for l in git_file._process_diff_body(diff_out)[0]] != [
+      tuple(l) for l in _legacy_process_diff_body(diff_out)[0]]:
+    print('parsers disagree')
+    sys.exit(1)
+
+  for name, parse in [
+      ('legacy', _legacy_process_diff_body),
+      ('current', git_file._process_diff_body)]:
+    print('{0}: {1:.1f}ms (best of {2}){3}'.format(
+        name, _best_of(runs, parse, diff_out) * 1000, runs,
+        _peak_memory(parse, diff_out)))
+
+
+def _make_diff(n):
+  """Returns the lines of a diff body with about n lines."""
+  lines = []
+  old = new = 1
+  while len(lines) < n:
+    lines.append('@@ -{0},8 +{1},8 @@ def f():'.format(old, new))
+    for i in range(3):
+      lines.append(' context line {0}'.format(old + i))
+    lines.append('-  return {0}'.format(old))
+    lines.append('+  return {0}'.format(new + 1))
+    for i in range(4):
+      lines.append(' context line {0}'.format(old + i + 4))
+    old += 20
+    new += 20
+  return lines
+
+
+def _best_of(runs, parse, diff_out):
+  best = None
+  for _ in range(runs):
+    start = time.time()
+    parse(diff_out)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+def _peak_memory(parse, diff_out):
+  if not tracemalloc:
+    return ''
+  tracemalloc.start()
+  ret = parse(diff_out)
+  _, peak = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+  del ret
+  return ', peak {0:.1f}MB'.format(peak / 1024.0 / 1024.0)
+
+
+def _legacy_process_diff_body(diff_out):
+  MIN_LINE_PADDING = 8
+  LineData = collections.namedtuple(
+      'LineData',
+      ['line', 'status', 'old_line_number', 'new_line_number'])
+
+  resulting = []  # accumulates line information for formatting.
+  max_line_digits = 0
+  additions = 0
+  removals = 0
+  old_line_number = 1
+  new_line_number = 1
+
+  # @@ -(start of old),(length of old) +(start of new),(length of new) @@
+  new_hunk_regex = r'^@@ -([0-9]+)[,]?([0-9]*) \+([0-9]+)[,]?([0-9]*) @@'
+  for line in diff_out:
+    new_hunk_info = re.search(new_hunk_regex, line)
+    if new_hunk_info:
+      get_info_or_zero = lambda g: 0 if g == '' else int(g)
+      old_line_number = get_info_or_zero(new_hunk_info.group(1))
+      old_diff_length = get_info_or_zero(new_hunk_info.group(2))
+      new_line_number = get_info_or_zero(new_hunk_info.group(3))
+      new_diff_length = get_info_or_zero(new_hunk_info.group(4))
+      resulting.append(
+          LineData(line, git_file.DIFF_INFO, old_line_number, new_line_number))
+      max_line_digits = max([old_line_number + old_diff_length,
+                             new_line_number + new_diff_length,
+                             max_line_digits])  # start + length of each diff.
+    elif line.startswith(' '):
+      resulting.append(
+          LineData(line, git_file.DIFF_SAME, old_line_number, new_line_number))
+      old_line_number += 1
+      new_line_number += 1
+    elif line.startswith('-'):
+      resulting.append(
+          LineData(line, git_file.DIFF_MINUS, old_line_number, None))
+      old_line_number += 1
+      removals += 1
+    elif line.startswith('+'):
+      resulting.append(
+          LineData(line, git_file.DIFF_ADDED, None, new_line_number))
+      new_line_number += 1
+      additions += 1
+
+  max_line_digits = len(str(max_line_digits))  # digits = len(string of number).
+  max_line_digits = max(MIN_LINE_PADDING, max_line_digits + 1)
+  return resulting, max_line_digits, additions, removals
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Benchmark for the cold-start time of importing gitpylib.
+
+Each sample is a fresh interpreter that imports all gitpylib modules, the time
+of an interpreter that imports nothing is subtracted. It also checks that the
+import leaves nothing behind in the temp dir.
+
+Usage: python benchmarks/import_time.py [runs]
+"""
+
+
+from __future__ import print_function
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+MODULES = [
+    'apply', 'branch', 'cat_file', 'common', 'config', 'file', 'hook', 'log',
+    'remote', 'repo', 'stash', 'status', 'sync']
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+  stmt = 'import ' + ', '.join('gitpylib.' + m for m in MODULES)
+
+  tmp_before = set(os.listdir(tempfile.gettempdir()))
+  base = _best_of(runs, 'pass')
+  imp = _best_of(runs, stmt)
+  tmp_after = set(os.listdir(tempfile.gettempdir()))
+
+  print('import gitpylib: {0:.2f}ms (best of {1})'.format(
+      (imp - base) * 1000, runs))
+  leaked = tmp_after - tmp_before
+  if leaked:
+    print('temp files left behind: {0}'.format(', '.join(sorted(leaked))))
+    sys.exit(1)
+
+
+def _best_of(runs, stmt):
+  env = dict(os.environ, PYTHONPATH=REPO_ROOT, PYTHONDONTWRITEBYTECODE='1')
+  best = None
+  for _ in range(runs):
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', stmt], env=env)
+    elapsed = time.time() - start
+    best = elapsed if best is None else min(best, elapsed)
+  return best
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Benchmark for the main gitpylib operations on a synthetic repo.
+
+Builds a local repo of the given size (files, commits, branches, remotes as
+bare file:// repos and stashes, plus some local changes), then times each
+operation and counts the git processes it runs (see gitpylib.instrument).
+
+The results are compared against the stored baseline (if it was taken with the
+same sizes): an operation regresses if it runs more processes than in the
+baseline or is slower than the baseline by more than the tolerance (and by
+more than a few milliseconds, to ignore noise in the fastest ones). The exit
+code is 1 if any operation regressed.
+
+Usage: python benchmarks/repo_ops.py [--files N] [--commits N] [--branches N]
+  [--remotes N] [--stashes N] [--runs N] [--tolerance F] [--baseline FILE]
+  [--save-baseline] [--keep]
+"""
+
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gitpylib import branch
+from gitpylib import common
+from gitpylib import file as git_file
+from gitpylib import instrument
+from gitpylib import log
+from gitpylib import remote
+from gitpylib import stash
+from gitpylib import status
+
+
+BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'repo_ops_baseline.json')
+
+# Files per dir in the synthetic repo.
+_FILES_PER_DIR = 100
+
+# Lines per file in the synthetic repo.
+_FILE_LINES = 50
+
+# Files modified by each commit after the first one.
+_FILES_PER_COMMIT = 5
+
+# Slowdowns smaller than this are noise, not regressions.
+_MIN_SLOWDOWN_SECS = 0.005
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Benchmark gitpylib operations on a synthetic repo.')
+  parser.add_argument('--files', type=int, default=2000)
+  parser.add_argument('--commits', type=int, default=200)
+  parser.add_argument('--branches', type=int, default=50)
+  parser.add_argument('--remotes', type=int, default=2)
+  parser.add_argument('--stashes', type=int, default=20)
+  parser.add_argument('--runs', type=int, default=5)
+  parser.add_argument(
+      '--tolerance', type=float, default=0.5,
+      help='how much slower than the baseline (0.5 = 50%%) is a regression')
+  parser.add_argument('--baseline', default=BASELINE)
+  parser.add_argument(
+      '--save-baseline', action='store_true',
+      help='store the results as the new baseline')
+  parser.add_argument(
+      '--keep', action='store_true', help="don't delete the synthetic repo")
+  args = parser.parse_args()
+  sizes = dict(
+      files=args.files, commits=args.commits, branches=args.branches,
+      remotes=args.remotes, stashes=args.stashes)
+
+  tmp = tempfile.mkdtemp(prefix='gitpylib-bench-')
+  try:
+    start = time.time()
+    work = make_repo(tmp, **sizes)
+    print('built repo in {0} in {1:.1f}s'.format(work, time.time() - start))
+    with common.Repo(work) as repo:
+      results = run_ops(repo, args.runs)
+  finally:
+    if args.keep:
+      print('kept', tmp)
+    else:
+      shutil.rmtree(tmp, ignore_errors=True)
+
+  baseline = _load_baseline(args.baseline, sizes)
+  regressed = _report(results, baseline, args.tolerance)
+  if args.save_baseline:
+    with open(args.baseline, 'w') as f:
+      json.dump(
+          {'sizes': sizes, 'results': results}, f, indent=2, sort_keys=True)
+      f.write('\n')
+    print('saved baseline to', args.baseline)
+  sys.exit(1 if regressed else 0)
+
+
+def make_repo(root, files, commits, branches, remotes, stashes):
+  """Builds a synthetic repo under root.
+
+  Args:
+    root: the dir to create the repo (and its remotes) in.
+    files: the number of files in the repo.
+    commits: the number of commits in the history of master.
+    branches: the number of branches (other than master), half of them track a
+      branch of the first remote.
+    remotes: the number of remotes, each a bare repo reached via file://.
+    stashes: the number of stashes.
+
+  Returns:
+    the path of the work tree of the repo.
+  """
+  work = os.path.join(root, 'work')
+  _git(root, 'init', '-q', work)
+  _git(work, 'fast-import', '--quiet', input=_history(files, commits))
+  _git(work, 'checkout', '-q', '-f', 'master')
+
+  for i in range(branches):
+    _git(work, 'branch', 'b{0}'.format(i), 'master~{0}'.format(
+        i % commits))
+
+  for i in range(remotes):
+    bare = os.path.join(root, 'remote{0}.git'.format(i))
+    _git(root, 'init', '-q', '--bare', bare)
+    name = 'r{0}'.format(i)
+    _git(work, 'remote', 'add', name, 'file://' + bare)
+    _git(work, 'push', '-q', name, '--all')
+  if remotes:
+    for i in range(0, branches, 2):
+      _git(
+          work, 'branch', '-q', '--set-upstream-to', 'r0/b{0}'.format(i),
+          'b{0}'.format(i))
+
+  for i in range(stashes):
+    _append(work, _fp(i % files), 'stashed change {0}'.format(i))
+    _git(work, 'stash', 'push', '-q', '-m', 'stash{0}'.format(i))
+
+  # Some local changes: modified (staged and unstaged), deleted and untracked
+  # files.
+  for i in range(0, min(files, 50)):
+    _append(work, _fp(i), 'local change')
+  _git(work, 'add', *[_fp(i) for i in range(0, min(files, 50), 2)])
+  for i in range(50, min(files, 60)):
+    os.remove(os.path.join(work, _fp(i)))
+  for i in range(20):
+    _append(work, 'untracked{0}.txt'.format(i), 'untracked')
+  return work
+
+
+def run_ops(repo, runs):
+  """Times the benchmarked operations.
+
+  Returns:
+    a dict that maps the name of each operation to a dict with its best time
+    ('secs') and the number of git processes it ran ('procs').
+  """
+  fp = _fp(1)  # Modified but not staged.
+  remote_name = remote.show_all(repo=repo)[:1]
+  ops = [
+      ('status.of', lambda: list(status.of(repo=repo))),
+      ('status.of_file', lambda: status.of_file(fp, repo=repo)),
+      ('file.diff', lambda: git_file.diff(fp, repo=repo)),
+      ('log.log(include_diffs=True)',
+       lambda: log.log(include_diffs=True, repo=repo)),
+      ('branch.status_all', lambda: list(branch.status_all(repo=repo))),
+  ]
+  if remote_name:
+    ops.append(
+        ('remote.branches',
+         lambda: list(remote.branches(remote_name[0], repo=repo))))
+  ops.append(('stash.pop', lambda: stash.pop('bench', repo=repo)))
+
+  results = {}
+  for name, op in ops:
+    setup = _stash_bench(repo) if name == 'stash.pop' else None
+    best = None
+    procs = None
+    for _ in range(runs):
+      if setup:
+        setup()
+      with instrument.profile() as prof:
+        start = time.time()
+        op()
+        elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+      procs = prof.count
+    results[name] = {'secs': best, 'procs': procs}
+  return results
+
+
+def _stash_bench(repo):
+  """Returns a function that creates the stash stash.pop pops."""
+  def setup():
+    _append(repo.path, _fp(2), 'to stash')
+    _git(repo.path, 'stash', 'push', '-q', '-m', 'bench', '--', _fp(2))
+  return setup
+
+
+def _history(files, commits):
+  """Returns a fast-import stream with the given number of commits."""
+  out = []
+  mark = [0]
+
+  def blob(content):
+    mark[0] += 1
+    data = content.encode('utf-8')
+    out.append(b'blob\nmark :' + str(mark[0]).encode('ascii') + b'\n')
+    out.append(b'data ' + str(len(data)).encode('ascii') + b'\n' + data + b'\n')
+    return mark[0]
+
+  now = int(time.time()) - commits * 60
+  for c in range(commits):
+    if c == 0:
+      changed = range(files)
+    else:
+      changed = [
+          (c * _FILES_PER_COMMIT + i) % files for i in range(_FILES_PER_COMMIT)]
+    marks = [(i, blob(_content(i, c))) for i in changed]
+    msg = 'commit {0}\n'.format(c).encode('utf-8')
+    out.append(b'commit refs/heads/master\n')
+    out.append(
+        'committer Bench <bench@example.com> {0} +0000\n'.format(
+            now + c * 60).encode('ascii'))
+    out.append(b'data ' + str(len(msg)).encode('ascii') + b'\n' + msg)
+    for i, m in marks:
+      out.append('M 100644 :{0} {1}\n'.format(m, _fp(i)).encode('utf-8'))
+    out.append(b'\n')
+  return b''.join(out)
+
+
+def _content(i, c):
+  lines = ['file {0} line {1}'.format(i, l) for l in range(_FILE_LINES)]
+  lines[c % _FILE_LINES] = 'file {0} changed in commit {1}'.format(i, c)
+  return '\n'.join(lines) + '\n'
+
+
+def _fp(i):
+  return 'd{0}/f{1}.txt'.format(i // _FILES_PER_DIR, i)
+
+
+def _append(work, fp, line):
+  path = os.path.join(work, fp)
+  with open(path, 'a') as f:
+    f.write(line + '\n')
+
+
+def _git(cwd, *args, **kwargs):
+  env = dict(os.environ)
+  env.update(
+      GIT_AUTHOR_NAME='Bench', GIT_AUTHOR_EMAIL='bench@example.com',
+      GIT_COMMITTER_NAME='Bench', GIT_COMMITTER_EMAIL='bench@example.com')
+  p = subprocess.Popen(
+      ('git',) + args, cwd=cwd, env=env, stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  out, err = p.communicate(kwargs.get('input'))
+  if p.returncode != 0:
+    raise Exception('git {0} failed: {1}'.format(' '.join(args), err))
+  return out
+
+
+def _load_baseline(fp, sizes):
+  if not os.path.exists(fp):
+    return None
+  with open(fp) as f:
+    baseline = json.load(f)
+  if baseline.get('sizes') != sizes:
+    print('baseline was taken with other sizes ({0}), not comparing'.format(
+        baseline.get('sizes')))
+    return None
+  return baseline['results']
+
+
+def _report(results, baseline, tolerance):
+  """Prints the results.
+
+  Returns:
+    True iff any operation regressed.
+  """
+  regressed = False
+  for name in sorted(results):
+    r = results[name]
+    line = '{0:<30} {1:>9.1f}ms {2:>4} procs'.format(
+        name, r['secs'] * 1000, r['procs'])
+    b = baseline.get(name) if baseline else None
+    if b:
+      problems = []
+      if r['procs'] > b['procs']:
+        problems.append('procs {0} -> {1}'.format(b['procs'], r['procs']))
+      slowdown = r['secs'] - b['secs']
+      if (slowdown > b['secs'] * tolerance and
+          slowdown > _MIN_SLOWDOWN_SECS):
+        problems.append('{0:.1f}ms -> {1:.1f}ms'.format(
+            b['secs'] * 1000, r['secs'] * 1000))
+      if problems:
+        regressed = True
+        line += '  REGRESSED ({0})'.format(', '.join(problems))
+      else:
+        line += '  ok (baseline {0:.1f}ms, {1} procs)'.format(
+            b['secs'] * 1000, b['procs'])
+    print(line)
+  return regressed
+
+
+if __name__ == '__main__':
+  main()
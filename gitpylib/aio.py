@@ -0,0 +1,235 @@
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Module for querying Git repos from asyncio code (Python 3.5+ only).
+
+The functions in this module are coroutines that work like their counterparts
+in the other modules (and share their parsers), but run git with
+asyncio.create_subprocess_exec instead of blocking the event loop. Results are
+returned as lists instead of being yielded.
+
+At most MAX_PROCS git processes are run at the same time per event loop, the
+rest wait for their turn. This makes it possible to query many repos at once,
+e.g.:
+
+  repos = [common.Repo(path) for path in paths]
+  statuses = await asyncio.gather(*[aio.status_of(repo=r) for r in repos])
+"""
+
+
+import asyncio
+import shlex
+import subprocess
+import weakref
+
+from . import branch as git_branch
+from . import common
+from . import log as git_log
+from . import remote as git_remote
+from . import status as git_status
+
+
+# Max number of git processes run at the same time in each event loop. Changes
+# only apply to event loops that haven't run any git process yet.
+MAX_PROCS = 8
+
+# Event loop -> semaphore that bounds the number of git processes it runs.
+_semaphores = weakref.WeakKeyDictionary()
+
+
+async def git_call(cmd, input=None, repo=None):
+  """Runs the given git command (see common.git_call).
+
+  Returns:
+    a tuple (ok, out, err) where ok is True iff the command succeeded.
+  """
+  if input is not None:
+    input = input.encode('utf-8')
+  args = ['git'] + shlex.split(cmd)
+  kwargs = {
+      'cwd': repo.path if repo else None,
+      'stdin': subprocess.PIPE if input is not None else None,
+      'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE}
+  async with _semaphore():
+    # These processes are reported to the hooks too (see instrument).
+    trace = common._start_trace(args, kwargs)
+    p = await asyncio.create_subprocess_exec(*args, **kwargs)
+    try:
+      out, err = await p.communicate(input)
+    except BaseException:
+      # E.g., the task was cancelled.
+      if p.returncode is None:
+        p.kill()
+        await p.wait()
+      common._end_trace(trace, p.returncode, None, None)
+      raise
+  common._end_trace(trace, p.returncode, len(out), len(err))
+  return p.returncode == 0, common._decode(out), common._decode(err)
+
+
+async def safe_git_call(cmd, input=None, repo=None):
+  """Like git_call but raises an exception if the command fails.
+
+  Returns:
+    a tuple (out, err).
+  """
+  ok, out, err = await git_call(cmd, input=input, repo=repo)
+  if ok:
+    return out, err
+  raise Exception('{0} failed: out is {1}, err is {2}'.format(cmd, out, err))
+
+
+async def status_of(only_paths=None, relative_paths=None, repo=None):
+  """Status of the repo or of the only_paths given (see status.of).
+
+  Returns:
+    a list of (fp, status) pairs.
+  """
+  # We need a handle whose config we can load without blocking before reading
+  # the index (index.read uses the config of the repo).
+  repo = repo or common.Repo()
+  c = await _config('status.relativePaths', repo)
+  if not relative_paths:
+    relative_paths = c if c else True  # git seems to default to true
+
+  pathspecs = git_status._pathspecs(only_paths, repo)
+  out, _ = await safe_git_call(
+      git_status._STATUS_CMD.format(pathspecs), repo=repo)
+  porcelain = git_status._parse_porcelain(_records(out, '\0'))
+
+  # Reading the index is done in-process, so we do it in a thread.
+  ls_files = await asyncio.get_event_loop().run_in_executor(
+      None, _index_files, only_paths, repo)
+  if ls_files is None:
+    out, _ = await safe_git_call(
+        git_status._LS_FILES_CMD.format(pathspecs), repo=repo)
+    ls_files = git_status._parse_ls_files(_records(out, '\0'))
+
+  return list(git_status._merge(
+      porcelain, ls_files, git_status._fp_fixer(relative_paths, repo)))
+
+
+async def branch_status_all(repo=None):
+  """Get the status of all existing branches (see branch.status_all).
+
+  Returns:
+    a list of BranchStatus namedtuples.
+  """
+  ret = []
+  head = git_branch._read_head(common.git_dir(repo=repo))
+  if head is None:
+    ok, out, _ = await git_call('symbolic-ref -q HEAD', repo=repo)
+    head = out.strip() if ok else ''
+  if not head.startswith('refs/heads/'):
+    # for-each-ref doesn't list detached HEADs.
+    ret.append(
+        git_branch.BranchStatus(git_branch.DETACHED_HEAD, True, None))
+  out, _ = await safe_git_call(
+      git_branch._BRANCH_CMD.format('refs/heads/'), repo=repo)
+  ret.extend(git_branch._parse_branch(line) for line in _records(out, '\n'))
+  return ret
+
+
+async def log(
+    include_diffs=False, max_count=None, skip=None, since=None, until=None,
+    revs=None, paths=None, repo=None):
+  """Gets the commits in the log (see log.iter_log).
+
+  Returns:
+    a list of Commit namedtuples, most recent first.
+  """
+  out, _ = await safe_git_call(
+      git_log._log_cmd(
+          include_diffs, max_count, skip, since, until, revs, paths),
+      repo=repo)
+  return list(git_log._parse_log(_records(out, '\0')))
+
+
+async def remote_show_all(repo=None):
+  """Get the names of all the remotes (see remote.show_all)."""
+  out, _ = await safe_git_call('remote', repo=repo)
+  return out.splitlines()
+
+
+async def remote_show_all_v(repo=None):
+  """Get information of all the remotes (see remote.show_all_v)."""
+  out, _ = await safe_git_call('remote -v', repo=repo)
+  return git_remote._parse_remote_v(out)
+
+
+async def remote_refs(remote_name, max_age=None, repo=None):
+  """Gets the refs of the given remote (see remote.refs).
+
+  Snapshots are shared with remote.refs.
+  """
+  # We need a handle whose config we can load without blocking.
+  repo = repo or common.Repo()
+  url = await _config('remote.{0}.url'.format(remote_name), repo)
+  key = repo.git_dir, remote_name, url
+  ret = git_remote._cached_refs(key, max_age)
+  if ret is None:
+    ok, out, _ = await git_call(
+        git_remote._LS_REMOTE_CMD.format(remote_name), repo=repo)
+    if not ok:
+      return None
+    ret = git_remote._store_refs(key, out)
+  return ret
+
+
+async def remote_head_exist(remote_name, head, repo=None):
+  """See remote.head_exist."""
+  snapshot = await remote_refs(remote_name, repo=repo)
+  if snapshot is None:
+    return False, git_remote.REMOTE_UNREACHABLE
+  return 'refs/heads/' + head in snapshot, git_remote.REMOTE_BRANCH_NOT_FOUND
+
+
+async def remote_branches(remote_name, repo=None):
+  """Gets the name of the branches in the given remote (see
+  remote.branches)."""
+  out, _ = await safe_git_call(
+      git_remote._BRANCHES_CMD.format(remote_name), repo=repo)
+  return list(git_remote._parse_branches(remote_name, out))
+
+
+# Private functions.
+
+
+def _semaphore():
+  loop = asyncio.get_event_loop()
+  sem = _semaphores.get(loop)
+  if sem is None:
+    sem = _semaphores[loop] = asyncio.Semaphore(MAX_PROCS)
+  return sem
+
+
+def _records(out, sep):
+  """Splits the output of a command like common.git_stream does."""
+  records = out.split(sep)
+  if not records[-1]:
+    records.pop()
+  return records
+
+
+def _index_files(only_paths, repo):
+  """Lists the files in the index like status._ls_files does.
+
+  Returns:
+    a list of (fp, tag) pairs or None if ls-files has to be run instead.
+  """
+  idx = git_status._read_index(only_paths, repo)
+  if not idx:
+    return None
+  with idx:
+    return list(git_status._index_files(idx, only_paths, repo))
+
+
+async def _config(var, repo):
+  """Like config.get but doesn't block to read the config."""
+  if not repo:
+    ok, out, _ = await git_call('config {0}'.format(var))
+    return out.strip() if ok else None
+  if repo._config is None:
+    ok, out, _ = await git_call('config --list -z', repo=repo)
+    repo._config = common._parse_config(out) if ok else {}
+  return repo.config(var)
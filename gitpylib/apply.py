@@ -5,6 +5,6 @@
 from . import common
 
 
-def on_index(patch_file):
-  ok, _, _ = common.git_call('apply --cached {0}'.format(patch_file))
+def on_index(patch_file, repo=None):
+  ok, _, _ = common.git_call('apply --cached {0}'.format(patch_file), repo=repo)
   return ok
@@ -5,7 +5,9 @@
 
 
 import collections
+import os
 import re
+import threading
 
 from . import common
 
@@ -13,6 +15,8 @@ from . import common
 BranchStatus = collections.namedtuple(
   'BranchStatus', ['name', 'is_current', 'tracks'])
 
+Divergence = collections.namedtuple('Divergence', ['ahead', 'behind'])
+
 SUCCESS = 1
 UNFETCHED_OBJECT = 2
 INVALID_NAME = 3
@@ -20,8 +24,11 @@ NONEXISTENT_BRANCH = 4
 BRANCH_ALREADY_EXISTS = 5
 INVALID_SP = 6
 
+# The name of the current branch when HEAD is detached.
+DETACHED_HEAD = '(no branch)'
+
 
-def checkout(name):
+def checkout(name, repo=None):
   """Checkout branch.
 
   Args:
@@ -30,13 +37,13 @@ def checkout(name):
   Returns:
     SUCCESS or NONEXISTENT_BRANCH
   """
-  ok, _, _ = common.git_call('checkout {0}'.format(name))
+  ok, _, _ = common.git_call('checkout {0}'.format(name), repo=repo)
   if not ok:
     return NONEXISTENT_BRANCH
   return SUCCESS
 
 
-def create(name, sp='HEAD'):
+def create(name, sp='HEAD', repo=None):
   """Creates a new branch with the given name.
 
   Args:
@@ -47,7 +54,7 @@ def create(name, sp='HEAD'):
   Returns:
     SUCCESS, INVALID_NAME or BRANCH_ALREADY_EXISTS.
   """
-  ok, _, err = common.git_call('branch {0} {1}'.format(name, sp))
+  ok, _, err = common.git_call('branch {0} {1}'.format(name, sp), repo=repo)
   if not ok:
     if 'is not a valid branch name' in err:
       return INVALID_NAME
@@ -58,7 +65,7 @@ def create(name, sp='HEAD'):
   return SUCCESS
 
 
-def force_delete(name):
+def force_delete(name, repo=None):
   """Force-deletes the branch with the given name.
 
   Args:
@@ -67,20 +74,37 @@ def force_delete(name):
   Returns:
     SUCCESS or NONEXISTENT_BRANCH
   """
-  ok, _, _ = common.git_call('branch -D {0}'.format(name))
+  ok, _, _ = common.git_call('branch -D {0}'.format(name), repo=repo)
   if not ok:
     return NONEXISTENT_BRANCH
   return SUCCESS
 
 
-def current():
-  """Get the name of the current branch."""
-  for name, is_current, _ in status_all():
-    if is_current:
-      return name
+def current(repo=None):
+  """Get the name of the current branch.
 
+  HEAD is read directly, no git process is run.
 
-def status(name):
+  Returns:
+    the name of the current branch, '(no branch)' if HEAD is detached or None
+    if the current branch doesn't have any commits yet.
+  """
+  gd = common.git_dir(repo=repo)
+  head = _read_head(gd)
+  if head is None:
+    # Not a ref storage we know how to read (e.g., reftable).
+    for name, is_current, _ in status_all(repo=repo):
+      if is_current:
+        return name
+    return None
+  if not head.startswith('refs/heads/'):
+    return DETACHED_HEAD
+  if not _ref_exists(head, gd):
+    return None
+  return head[len('refs/heads/'):]
+
+
+def status(name, repo=None):
   """Get the status of the branch with the given name.
 
   Args:
@@ -92,14 +116,14 @@ def status(name):
     remote branch it tracks (in the format 'remote_name/remote_branch') or None
     if it is a local branch.
   """
-  out, _ = common.safe_git_call('branch --list -vv {0}'.format(name))
-  if not out:
-    return None
+  for b in _for_each_branch('"refs/heads/{0}"'.format(name), repo):
+    # for-each-ref also matches the branches under name/.
+    if b.name == name:
+      return b
+  return None
 
-  return _parse_output(out)
 
-
-def status_all():
+def status_all(repo=None):
   """Get the status of all existing branches.
 
   Yields:
@@ -108,12 +132,80 @@ def status_all():
     tracks (in the format 'remote_name/remote_branch') or None if it is a local
     branch. name could be equal to '(no branch)' if the user is in no branch.
   """
-  out, _ = common.safe_git_call('branch --list -vv')
-  for b in out.splitlines():
-    yield _parse_output(b)
+  head = _read_head(common.git_dir(repo=repo))
+  if head is None:
+    ok, out, _ = common.git_call('symbolic-ref -q HEAD', repo=repo)
+    head = out.strip() if ok else ''
+  if not head.startswith('refs/heads/'):
+    # for-each-ref doesn't list detached HEADs.
+    yield BranchStatus(DETACHED_HEAD, True, None)
+  for b in _for_each_branch('refs/heads/', repo):
+    yield b
+
 
+def divergence(names=None, jobs=None, repo=None):
+  """Computes how many commits branches are ahead and behind their upstream.
 
-def set_upstream(branch, upstream_branch):
+  Unlike status and status_all, this has to walk the history of each branch
+  and its upstream (git uses the commit-graph file to speed this up if there's
+  one, see git commit-graph). Branches are split in chunks that are processed
+  in parallel, each by one git process.
+
+  Args:
+    names: the names of the branches to compute the divergence of (defaults to
+      all branches).
+    jobs: the max number of git processes to run at the same time (defaults to
+      the number of CPUs).
+
+  Returns:
+    a dict that maps the name of each existing branch of the given ones to None
+    if the branch doesn't have an upstream (or its upstream is gone) or to a
+    namedtuple (ahead, behind) with the number of commits in the branch that
+    are not in its upstream and vice versa.
+  """
+  if names is None:
+    names = [b.name for b in _for_each_branch('refs/heads/', repo)]
+  names = list(names)
+  if not names:
+    return {}
+  jobs = jobs or _cpu_count()
+  n_chunks = min(jobs, (len(names) + _MIN_CHUNK - 1) // _MIN_CHUNK)
+  chunks = [names[i::n_chunks] for i in range(n_chunks)]
+
+  results = [None] * n_chunks
+  errors = []
+  # So that the processes of all chunks are killed if the caller's are (see
+  # multi.run).
+  state = common._inheritable()
+
+  def run(i):
+    try:
+      with common._inherited(state):
+        results[i] = _divergence(chunks[i], repo)
+    except Exception as e:
+      errors.append(e)
+
+  threads = [
+      threading.Thread(target=run, args=(i,)) for i in range(1, n_chunks)]
+  for t in threads:
+    t.start()
+  run(0)  # The first chunk is processed in this thread.
+  for t in threads:
+    t.join()
+  if errors:
+    raise errors[0]
+
+  ret = {}
+  wanted = set(names)
+  for r in results:
+    for name, d in common.items(r):
+      # for-each-ref also matches the branches under name/.
+      if name in wanted:
+        ret[name] = d
+  return ret
+
+
+def set_upstream(branch, upstream_branch, repo=None):
   """Sets the upstream branch to branch.
 
   Args:
@@ -121,7 +213,8 @@ def set_upstream(branch, upstream_branch):
     upstream_branch: the upstream branch.
   """
   ok, _, _ = common.git_call(
-      'branch --set-upstream {0} {1}'.format(branch, upstream_branch))
+      'branch --set-upstream {0} {1}'.format(branch, upstream_branch),
+      repo=repo)
 
   if not ok:
     return UNFETCHED_OBJECT
@@ -129,44 +222,114 @@ def set_upstream(branch, upstream_branch):
   return SUCCESS
 
 
-def unset_upstream(branch):
+def unset_upstream(branch, repo=None):
   """Unsets the upstream branch to branch.
 
   Args:
     branch: the branch to unset its upstream.
   """
-  common.git_call('branch --unset-upstream {0}'.format(branch))
+  common.git_call('branch --unset-upstream {0}'.format(branch), repo=repo)
   return SUCCESS
 
 
-def _parse_output(out):
-  """Parses branch list output.
+# Private functions.
 
-  Args:
-    out: the output for one branch.
+
+# Min number of branches given to one git process by divergence (so that we
+# don't start a process for just a few branches).
+_MIN_CHUNK = 16
+
+_BRANCH_FMT = '%(HEAD)%00%(refname:lstrip=2)%00%(upstream:short)'
+
+
+def _for_each_branch(pattern, repo):
+  """Lists the branches that match the given for-each-ref pattern.
+
+  Unlike branch -vv, for-each-ref doesn't compare each branch with its upstream
+  (no commits are walked).
+
+  Yields:
+    BranchStatus namedtuples.
+  """
+  out = common.git_stream(_BRANCH_CMD.format(pattern), repo=repo)
+  for line in out:
+    yield _parse_branch(line)
+
+
+_BRANCH_CMD = 'for-each-ref --format="{0}" {{0}}'.format(_BRANCH_FMT)
+
+
+def _parse_branch(line):
+  fields = line.split('\0')
+  if len(fields) != 3:
+    raise common.UnexpectedOutputError('for-each-ref', line)
+  head, name, tracks = fields
+  return BranchStatus(name, head == '*', tracks or None)
+
+
+_DIVERGENCE_FMT = (
+    '%(refname:lstrip=2)%00%(upstream)%00%(upstream:track,nobracket)')
+_TRACK = re.compile(r'(?:ahead ([0-9]+))?(?:, )?(?:behind ([0-9]+))?$')
+
+
+def _divergence(names, repo):
+  out = common.git_stream(
+      'for-each-ref --format="{0}" "refs/heads/{1}"'.format(
+          _DIVERGENCE_FMT, '" "refs/heads/'.join(names)),
+      repo=repo)
+  ret = {}
+  for line in out:
+    fields = line.split('\0')
+    if len(fields) != 3:
+      raise common.UnexpectedOutputError('for-each-ref', line)
+    name, upstream, track = fields
+    if not upstream or track == 'gone':
+      ret[name] = None
+      continue
+    result = _TRACK.match(track)
+    if not result:
+      raise common.UnexpectedOutputError('for-each-ref', line)
+    ahead, behind = result.groups()
+    ret[name] = Divergence(int(ahead or 0), int(behind or 0))
+  return ret
+
+
+def _cpu_count():
+  # Python 2/3 compatibility.
+  if hasattr(os, 'cpu_count'):
+    return os.cpu_count() or 1
+  import multiprocessing
+  return multiprocessing.cpu_count()
+
+
+def _read_head(gd):
+  """Reads HEAD.
 
   Returns:
-    a tuple (name, is_current, tracks) where is_current is a boolean value and
-    tracks is a string representing the remote branch it tracks (in
-    the format 'remote_name/remote_branch') or None if it is a local branch.
+    the ref HEAD points to (e.g., 'refs/heads/master'), the commit id if HEAD
+    is detached or None if HEAD can't be read directly.
   """
-  # * indicates whether it's the current branch or not, next comes the name of
-  # the branch followed by the sha1, optionally followed by some remote tracking
-  # info (between brackets) and finally the message of the last commit.
-  if out.startswith('* (no branch)'):
-    return BranchStatus('(no branch)', True, None)
-
-  pattern = r'([\*| ]) ([^\s]+)[ ]+\w+ (.+)'
-  result = re.match(pattern, out)
-  if not result:
-    raise common.UnexpectedOutputError('branch', out)
-
-  tracks = None
-  if result.group(3)[0] == '[':
-    track_info = result.group(3).split(']')[0][1:]
-    tracks = ''
-    if ':' in track_info:
-      tracks = track_info.split(':')[0]
-    else:
-      tracks = track_info
-  return BranchStatus(result.group(2), result.group(1) == '*', tracks)
+  try:
+    with open(os.path.join(gd, 'HEAD')) as f:
+      head = f.read().strip()
+  except IOError:
+    return None
+  if head.startswith('ref: '):
+    head = head[len('ref: '):]
+    # Repos with a reftable have a dummy HEAD that points to an invalid name.
+    return None if head == 'refs/heads/.invalid' else head
+  return head if _SHA.match(head) else None
+
+
+_SHA = re.compile(r'^[0-9a-f]{40}([0-9a-f]{24})?$')
+
+
+def _ref_exists(ref, gd):
+  if os.path.isfile(os.path.join(gd, ref)):
+    return True
+  try:
+    with open(os.path.join(gd, 'packed-refs')) as f:
+      suffix = ' ' + ref + '\n'
+      return any(line.endswith(suffix) for line in f)
+  except IOError:
+    return False
@@ -0,0 +1,292 @@
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Module for talking to long-lived git cat-file processes."""
+
+
+import collections
+import subprocess
+import sys
+
+from . import common
+
+
+# Max amount of request bytes to write before reading the responses back. It
+# must stay well under the pipe buffer size so that we never block writing a
+# request while cat-file is blocked writing a response we haven't read yet.
+_PIPELINE_BYTES = 16384
+
+# Size of the chunks ObjectReader.read_to copies objects in.
+_COPY_CHUNK_SIZE = 65536
+
+
+class ReaderDiedError(Exception):
+  """The cat-file process exited while we were talking to it."""
+
+
+# What cat-file --batch-check says about an object.
+ObjectInfo = collections.namedtuple('ObjectInfo', ['id', 'type', 'size'])
+
+
+class _BatchProcess(object):
+  """A persistent `git cat-file` process run in one of its batch modes.
+
+  The process is started lazily on the first request and reused for all
+  subsequent requests. If it dies, it is restarted on the next request.
+  Subclasses set _ARGS and implement _read_response.
+  """
+
+  _ARGS = None
+
+  def __init__(self, cwd=None):
+    self.cwd = cwd
+    self._p = None
+    self._out_bytes = 0
+
+  def close(self):
+    """Shuts down the cat-file process (if it is running)."""
+    if not self._p:
+      return
+    p, self._p = self._p, None
+    try:
+      p.stdin.close()
+    except (IOError, OSError):
+      pass
+    p.stdout.close()
+    p.wait()
+    common._done(p, self._out_bytes)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _request_many(self, objs):
+    """Gets the response to a request for each of the given objects."""
+    ret = []
+    chunk = []
+    chunk_size = 0
+    for obj in objs:
+      req = _encode(obj) + b'\n'
+      if chunk and chunk_size + len(req) > _PIPELINE_BYTES:
+        ret.extend(self._request(chunk))
+        chunk = []
+        chunk_size = 0
+      chunk.append(req)
+      chunk_size += len(req)
+    if chunk:
+      ret.extend(self._request(chunk))
+    return ret
+
+  def _request(self, chunk):
+    try:
+      return self._try_request(chunk, self._read_response)
+    except (IOError, OSError, ReaderDiedError):
+      # The process died under us, start a new one and retry once.
+      self._kill()
+      return self._try_request(chunk, self._read_response)
+
+  def _try_request(self, chunk, read_response):
+    p = self._process()
+    try:
+      p.stdin.write(b''.join(chunk))
+      p.stdin.flush()
+      return [read_response(p.stdout) for _ in chunk]
+    except BaseException:
+      # Some responses of the chunk could still be unread, the process can't
+      # be used for other requests.
+      self._kill()
+      raise
+
+  def _read_response(self, out):
+    raise NotImplementedError()
+
+  def _read_header(self, out):
+    """Reads the header of the response to a request.
+
+    Returns:
+      None if the object doesn't exist or its ObjectInfo.
+    """
+    header = out.readline()
+    if not header.endswith(b'\n'):
+      raise ReaderDiedError()
+    self._out_bytes += len(header)
+    # Object names can have spaces, so we look at the end of the header to tell
+    # apart "<obj> missing" and "<obj> ambiguous" from a found object.
+    if header.endswith((b' missing\n', b' ambiguous\n')):
+      return None
+    parts = header.split()
+    if len(parts) != 3 or not parts[2].isdigit():
+      raise common.UnexpectedOutputError('cat-file', header)
+    return ObjectInfo(
+        parts[0].decode('ascii'), parts[1].decode('ascii'), int(parts[2]))
+
+  def _process(self):
+    if self._p and self._p.poll() is not None:
+      self._kill()
+    if not self._p:
+      self._out_bytes = 0
+      self._p = common._popen(
+          self._ARGS, cwd=self.cwd,
+          stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    return self._p
+
+  def _kill(self):
+    if not self._p:
+      return
+    if self._p.poll() is None:
+      self._p.kill()
+    self.close()
+
+
+class ObjectReader(_BatchProcess):
+  """A persistent `git cat-file --batch` process.
+
+  The process is started lazily on the first request and reused for all
+  subsequent requests. If it dies, it is restarted on the next request.
+  """
+
+  _ARGS = ['git', 'cat-file', '--batch']
+
+  def read(self, obj):
+    """Reads the given object.
+
+    Args:
+      obj: the object to read (any expression that cat-file understands, e.g.,
+        'HEAD:paper.tex').
+
+    Returns:
+      None if the object doesn't exist or a pair (type, content) where type is
+      the object type (e.g., 'blob') and content are the object's raw bytes.
+    """
+    return self.read_many([obj])[0]
+
+  def read_many(self, objs):
+    """Reads the given objects reusing the same cat-file process.
+
+    Args:
+      objs: a list of objects to read.
+
+    Returns:
+      a list with the result of read for each of the given objects (in order).
+    """
+    return self._request_many(objs)
+
+  def read_to(self, obj, fileobj, obj_type=None):
+    """Reads the given object into a file.
+
+    The content is copied in fixed-size chunks, so the object is never held in
+    memory as a whole.
+
+    Args:
+      obj: the object to read.
+      fileobj: the binary file-like object to write the object's raw bytes to.
+      obj_type: if given, objects of other types are treated as missing (e.g.,
+        'blob').
+
+    Returns:
+      None if the object doesn't exist (nothing is written) or its ObjectInfo.
+    """
+    found = []
+
+    def read_response(out):
+      info = self._read_header(out)
+      if not info:
+        return None
+      if obj_type and info.type != obj_type:
+        self._copy(out, info.size, _Discard())
+        return None
+      found.append(info)
+      self._copy(out, info.size, fileobj)
+      return info
+
+    req = [_encode(obj) + b'\n']
+    try:
+      return self._try_request(req, read_response)[0]
+    except (IOError, OSError, ReaderDiedError):
+      if found:
+        # Some of the content could have been written already, retrying would
+        # write it again.
+        raise
+      return self._try_request(req, read_response)[0]
+
+  def _read_response(self, out):
+    info = self._read_header(out)
+    if not info:
+      return None
+    content = _read_exactly(out, info.size + 1)[:-1]  # Strip the trailing LF.
+    self._out_bytes += info.size + 1
+    return info.type, content
+
+  def _copy(self, out, size, fileobj):
+    while size > 0:
+      data = out.read(min(size, _COPY_CHUNK_SIZE))
+      if not data:
+        raise ReaderDiedError()
+      fileobj.write(data)
+      size -= len(data)
+      self._out_bytes += len(data)
+    _read_exactly(out, 1)  # The trailing LF.
+    self._out_bytes += 1
+
+
+class ObjectChecker(_BatchProcess):
+  """A persistent `git cat-file --batch-check` process.
+
+  Like ObjectReader, but it only gets the id, type and size of objects (their
+  content is never read).
+  """
+
+  _ARGS = ['git', 'cat-file', '--batch-check']
+
+  def info(self, obj):
+    """Gets the id, type and size of the given object.
+
+    Args:
+      obj: the object to check (any expression that cat-file understands, e.g.,
+        'HEAD:paper.tex').
+
+    Returns:
+      None if the object doesn't exist or its ObjectInfo.
+    """
+    return self.info_many([obj])[0]
+
+  def info_many(self, objs):
+    """Gets the id, type and size of the given objects.
+
+    Args:
+      objs: a list of objects to check.
+
+    Returns:
+      a list with the result of info for each of the given objects (in order).
+    """
+    return self._request_many(objs)
+
+  def _read_response(self, out):
+    return self._read_header(out)
+
+
+class _Discard(object):
+  """A file that drops what is written to it."""
+
+  def write(self, data):
+    pass
+
+
+def _read_exactly(out, size):
+  buf = []
+  while size > 0:
+    data = out.read(size)
+    if not data:
+      raise ReaderDiedError()
+    buf.append(data)
+    size -= len(data)
+  return b''.join(buf)
+
+
+def _encode(s):
+  # Python 2/3 compatibility.
+  if sys.version > '3' or isinstance(s, unicode):
+    return s.encode('utf-8')
+  return s
@@ -4,18 +4,19 @@
 """Common methods used accross the gitpylib."""
 
 
+import atexit
+import codecs
+import collections
+import contextlib
+import itertools
+import json
 import os
 import shlex
 import subprocess
 import sys
-
-
-# Detect if FS is case-sensitive.
 import tempfile
-
-tmp_handle, tmp_path = tempfile.mkstemp()
-with tempfile.NamedTemporaryFile() as f_tmp:
-  FS_CASE_SENSITIVE = not os.path.exists(f_tmp.name.upper())
+import threading
+import time
 
 
 class UnexpectedOutputError(Exception):
@@ -33,18 +34,33 @@ class UnexpectedOutputError(Exception):
             self.cmd, self.out, err))
 
 
-def safe_git_call(cmd):
-  ok, out, err = git_call(cmd)
+def safe_git_call(cmd, input=None, repo=None):
+  ok, out, err = git_call(cmd, input=input, repo=repo)
   if ok:
     return out, err
   raise Exception('{0} failed: out is {1}, err is {2}'.format(cmd, out, err))
 
 
-def git_call(cmd):
-  p = subprocess.Popen(
-      shlex.split('git {0}'.format(cmd)),
+def git_call(cmd, input=None, repo=None):
+  """Runs the given git command.
+
+  Args:
+    cmd: the git command to run (e.g., 'status --porcelain').
+    input: if given, a string to send to the command's stdin.
+    repo: the Repo to run the command in (defaults to the cwd).
+
+  Returns:
+    a tuple (ok, out, err) where ok is True iff the command succeeded.
+  """
+  p = _popen(
+      shlex.split('git {0}'.format(cmd)), cwd=repo.path if repo else None,
+      stdin=subprocess.PIPE if input is not None else None,
       stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-  out, err = p.communicate()
+  # Python 2/3 compatibility.
+  if input is not None and sys.version > '3':
+    input = input.encode('utf-8')
+  out, err = p.communicate(input)
+  _done(p, len(out), len(err))
   # Python 2/3 compatibility.
   if sys.version > '3':
     out = out.decode('utf-8')
@@ -52,44 +68,542 @@ def git_call(cmd):
   return p.returncode == 0, out, err
 
 
-def real_case(fp):
+def git_stream(cmd, sep='\n', repo=None):
+  """Runs the given git command and yields its output as it is produced.
+
+  The output is never buffered as a whole, so this should be used for commands
+  whose output could be large.
+
+  Args:
+    cmd: the git command to run (e.g., 'ls-files -z').
+    sep: the separator of the records in the command's output (e.g., '\0' for
+      commands run with -z).
+    repo: the Repo to run the command in (defaults to the cwd).
+
+  Returns:
+    a GitStream that yields the records in the output of the command (without
+    the separator) and raises GitCallError if the command fails (once all its
+    output has been consumed).
+  """
+  return GitStream(cmd, sep=sep, repo=repo)
+
+
+class GitCallError(Exception):
+  """A git command failed.
+
+  Attributes:
+    cmd: the git command.
+    returncode: its exit code.
+    err: what it wrote to stderr.
+  """
+
+  def __init__(self, cmd, returncode, err):
+    super(GitCallError, self).__init__()
+    self.cmd = cmd
+    self.returncode = returncode
+    self.err = err
+
+  def __str__(self):
+    return '{0} failed: err is {1}'.format(self.cmd, self.err)
+
+
+class GitStream(object):
+  """The output of a git command, read as the command produces it.
+
+  Iterating over the stream yields the records in the output (without the
+  separator). The output is decoded incrementally, so only the chunk being read
+  and the record being built are kept in memory. Once the stream is exhausted
+  (or closed) returncode and err are set.
+
+  It can also be used as a context manager that closes it, so that the command
+  is shut down if the stream is not exhausted.
+
+  Attributes:
+    cmd: the git command.
+    returncode: the exit code of the command or None if it hasn't ended (it's
+      negative if the command was killed because the stream was closed early).
+    err: what the command wrote to stderr or None if it hasn't ended.
+  """
+
+  def __init__(self, cmd, sep='\n', repo=None, check=True):
+    """Starts reading the output of the given command.
+
+    Args:
+      cmd: the git command to run (e.g., 'log -p').
+      sep: the separator of the records in the command's output.
+      repo: the Repo to run the command in (defaults to the cwd).
+      check: if True, GitCallError is raised when the stream is exhausted if
+        the command failed.
+    """
+    self.cmd = cmd
+    self.returncode = None
+    self.err = None
+    self._check = check
+    self._records = self._read(sep, repo)
+
+  @property
+  def ok(self):
+    """True iff the command ended and succeeded."""
+    return self.returncode == 0
+
+  def __iter__(self):
+    return self
+
+  def __next__(self):
+    return next(self._records)
+
+  next = __next__  # Python 2/3 compatibility.
+
+  def close(self):
+    """Stops reading, killing the command if it's still running."""
+    self._records.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+  def _read(self, sep, repo):
+    # Stderr goes to a file so that the command can't block writing to it while
+    # we are reading stdout.
+    with tempfile.TemporaryFile() as err_f:
+      p = _popen(
+          shlex.split('git {0}'.format(self.cmd)),
+          cwd=repo.path if repo else None, stdout=subprocess.PIPE,
+          stderr=err_f)
+      out_bytes = 0
+      try:
+        decode = _incremental_decoder()
+        # The start of the record being read (a record can span many chunks).
+        pending = []
+        for chunk in iter(lambda: p.stdout.read(_STREAM_CHUNK_SIZE), b''):
+          out_bytes += len(chunk)
+          text = decode(chunk)
+          if sep not in text:
+            pending.append(text)
+            continue
+          records = text.split(sep)
+          pending.append(records[0])
+          records[0] = ''.join(pending)
+          pending = [records.pop()]
+          for r in records:
+            yield r
+        pending.append(decode(b'', True))
+        last = ''.join(pending)
+        if last:
+          yield last
+        p.wait()
+      finally:
+        p.stdout.close()
+        if p.poll() is None:
+          # The caller stopped consuming the output before it ended.
+          p.kill()
+          p.wait()
+        err_f.seek(0)
+        err = err_f.read()
+        self.returncode = p.returncode
+        self.err = _decode(err)
+        _done(p, out_bytes, len(err))
+    if self._check and self.returncode != 0:
+      raise GitCallError(self.cmd, self.returncode, self.err)
+
+
+def _incremental_decoder():
+  """Returns a function that decodes the output of a command chunk by chunk.
+
+  Chunks can end in the middle of a multi-byte character, the function is
+  called with final=True once there are no more chunks.
+  """
+  # Python 2/3 compatibility.
+  if sys.version > '3':
+    return codecs.getincrementaldecoder('utf-8')().decode
+  return lambda chunk, final=False: chunk
+
+
+# Size of the reads done by git_stream.
+_STREAM_CHUNK_SIZE = 65536
+
+
+# A git process run by gitpylib, as reported to the hooks (see instrument).
+#   args: the command line of the process.
+#   cwd: the dir it was run in (None for the cwd).
+#   api: the gitpylib function that was called from outside gitpylib to run it
+#     (e.g., 'gitpylib.status.of'). For the iterators some functions return,
+#     the process is run while the caller consumes them, so it's the generator
+#     that produces them (e.g., 'gitpylib.status._merge').
+#   site: where that function was called from, as 'file:line'.
+#   start: when the process was started (seconds since the epoch).
+#   secs: how long the process ran.
+#   returncode: the exit code of the process.
+#   out_bytes, err_bytes: how much output it wrote to stdout and stderr (None
+#     if it's not known).
+#   trace2: the GIT_TRACE2_EVENT events of the process if they were requested
+#     (see instrument.profile), else None.
+#   thread: the thread that ran the process, or the one it was run on behalf of
+#     (see _inheritable).
+Call = collections.namedtuple('Call', [
+    'args', 'cwd', 'api', 'site', 'start', 'secs', 'returncode', 'out_bytes',
+    'err_bytes', 'trace2', 'thread'])
+
+# Functions that are given the Call of each git process once it ends (see
+# instrument.add_hook).
+_hooks = []
+
+# Dirs to write the GIT_TRACE2_EVENT output of git processes to (only the last
+# one is used, see instrument.profile).
+_trace2_dirs = []
+
+# Used to name the GIT_TRACE2_EVENT output file of each process.
+_trace2_ids = itertools.count()
+
+
+def _popen(args, **kwargs):
+  """Starts a git process (all git processes are started here).
+
+  Whoever reads the output of the process has to call _done once it ends.
+  """
+  trace = _start_trace(args, kwargs)
+  p = subprocess.Popen(args, **kwargs)
+  p._gitpylib_trace = trace
+  group = getattr(_local, 'proc_group', None)
+  if group is not None:
+    group.add(p)
+  return p
+
+
+def _done(p, out_bytes=None, err_bytes=None):
+  """Reports that the given process (started with _popen) ended."""
+  _end_trace(p._gitpylib_trace, p.returncode, out_bytes, err_bytes)
+
+
+def _start_trace(args, kwargs):
+  """Gets ready to report a process that is about to be started.
+
+  Args:
+    args: the command line of the process.
+    kwargs: the keyword arguments the process will be started with, updated
+      with the environment the process needs if trace2 output was requested.
+
+  Returns:
+    what to give to _end_trace once the process ends.
+  """
+  if not _hooks:
+    return None
+  trace2_fp = None
+  if _trace2_dirs:
+    trace2_fp = os.path.join(_trace2_dirs[-1], str(next(_trace2_ids)))
+    env = dict(kwargs.get('env') or os.environ)
+    env['GIT_TRACE2_EVENT'] = trace2_fp
+    kwargs['env'] = env
+  api, site = getattr(_local, 'call_site', None) or _call_site()
+  thread = getattr(_local, 'thread', None) or threading.current_thread()
+  return args, kwargs.get('cwd'), api, site, time.time(), trace2_fp, thread
+
+
+def _end_trace(trace, returncode, out_bytes, err_bytes):
+  if not trace:
+    return
+  args, cwd, api, site, start, trace2_fp, thread = trace
+  call = Call(
+      args, cwd, api, site, start, time.time() - start, returncode, out_bytes,
+      err_bytes, _read_trace2(trace2_fp) if trace2_fp else None, thread)
+  for hook in list(_hooks):
+    hook(call)
+
+
+def _read_trace2(fp):
+  try:
+    with open(fp) as f:
+      return [json.loads(line) for line in f if line.strip()]
+  except (IOError, OSError):
+    return []
+  finally:
+    try:
+      os.remove(fp)
+    except OSError:
+      pass
+
+
+def _call_site():
+  """Finds out who started the process that is about to be started.
+
+  Returns:
+    a pair (api, site) (see Call).
+  """
+  prefix = __name__.rpartition('.')[0] + '.'
+  api = site = None
+  f = sys._getframe(1)
+  while f:
+    if f.f_globals.get('__name__', '').startswith(prefix):
+      api = '{0}.{1}'.format(f.f_globals['__name__'], f.f_code.co_name)
+    elif api:
+      site = '{0}:{1}'.format(f.f_code.co_filename, f.f_lineno)
+      break
+    f = f.f_back
+  return api, site
+
+
+# Thread-local state (see _ProcGroup and _inheritable).
+_local = threading.local()
+
+
+def _inheritable():
+  """Gets the thread-local state threads started to do part of the work of
+  this thread should have (see _inherited).
+
+  This way, the processes they start are killed along with the ones of this
+  thread (see multi.run) and are reported as started by the same call.
+  """
+  return {
+      'proc_group': getattr(_local, 'proc_group', None),
+      'call_site': (
+          getattr(_local, 'call_site', None) or
+          (_call_site() if _hooks else None)),
+      'thread': getattr(_local, 'thread', None) or threading.current_thread(),
+  }
+
+
+@contextlib.contextmanager
+def _inherited(state):
+  """Sets the thread-local state of this thread while the context is active.
+
+  Args:
+    state: what _inheritable returned.
+  """
+  old = dict((k, getattr(_local, k, None)) for k in state)
+  for k, v in state.items():
+    setattr(_local, k, v)
+  try:
+    yield
+  finally:
+    for k, v in old.items():
+      setattr(_local, k, v)
+
+
+class _ProcGroup(object):
+  """The git processes started by a thread while it runs some task.
+
+  While a group is set as the thread's proc_group, all git processes started by
+  the thread are added to it, so that they can be killed all at once from any
+  thread (see multi.run). Once the group is killed, any process added to it is
+  killed right away.
+  """
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._procs = []
+    self._killed = False
+
+  def add(self, p):
+    with self._lock:
+      if self._killed:
+        _kill(p)
+      else:
+        self._procs.append(p)
+
+  def kill(self):
+    with self._lock:
+      self._killed = True
+      for p in self._procs:
+        _kill(p)
+      self._procs = []
+
+
+def _kill(p):
+  if p.poll() is None:
+    try:
+      p.kill()
+    except OSError:
+      # Python 2: the process ended in the meantime.
+      pass
+
+
+def _decode(b):
+  # Python 2/3 compatibility.
+  if sys.version > '3':
+    return b.decode('utf-8')
+  return b
+
+
+def real_case(fp, repo=None):
   """Returns the same file path with its real casing.
 
   Args:
     fp: the file path to get the real-casing for. It should correspond to an
         existing file.
+    repo: the Repo fp is relative to (defaults to the cwd).
 
   Returns:
     the same file path with its real casing.
   """
-  if FS_CASE_SENSITIVE:
-    return fp
+  return real_case_many([fp], repo=repo)[0]
+
+
+def real_case_many(fps, repo=None):
+  """Returns the same file paths with their real casing.
+
+  Each directory is listed at most once (and only if it changed since the last
+  time it was listed) and each prefix shared by the given paths is resolved
+  only once.
+
+  Args:
+    fps: the file paths to get the real-casing for. They should correspond to
+        existing files.
+    repo: the Repo the paths are relative to (defaults to the cwd).
+
+  Returns:
+    a list with the same file paths (in order) with their real casing.
+  """
+  start = cwd(repo=repo)
+  if fs_case_sensitive(repo=repo):
+    return list(fps)
+
+  listings = {}  # dir path -> {lowercase name: real name}
+  prefixes = {}  # path prefix -> (real path prefix, dir path)
+  return [_real_case(fp, start, listings, prefixes) for fp in fps]
 
-  cdir = os.getcwd()
-  ret = []
+
+def _real_case(fp, start, listings, prefixes):
+  cdir = start
+  real = None
+  prefix = ''
   for p in fp.split('/'):
-    found = False
-    for f in os.listdir(cdir):
-      if f.lower() == p.lower():
-        cdir = os.path.join(cdir, p)
-        ret.append(f)
-        found = True
-        break
-    if not found:
+    prefix += '/' + p
+    if prefix in prefixes:
+      real, cdir = prefixes[prefix]
+      continue
+    f = _listing(cdir, listings).get(p.lower())
+    if f is None:
       # TODO(sperezde): fix this hack (deal with filenames with special
       # characters).
       return fp
-  return os.path.join(*ret)
+    real = os.path.join(real, f) if real else f
+    cdir = os.path.join(cdir, f)
+    prefixes[prefix] = real, cdir
+  return real
+
+
+# Dir path -> (mtime, {lowercase name: real name}).
+_dir_listings = {}
+
+# Listings of dirs modified less than this many seconds ago are not cached since
+# they could be modified again without their mtime changing.
+_RACY_DIR_SECS = 2
+
+
+def _listing(d, listings):
+  """Gets the listing of the given dir.
+
+  The listing is read from the cache if the dir didn't change since it was
+  cached. listings memoizes the result for the duration of one real_case_many
+  call (so that each dir is stat'ed only once).
+  """
+  if d in listings:
+    return listings[d]
+  mtime = os.stat(d).st_mtime
+  cached = _dir_listings.get(d)
+  if cached and cached[0] == mtime:
+    ret = cached[1]
+  else:
+    ret = dict((f.lower(), f) for f in os.listdir(d))
+    if time.time() - mtime > _RACY_DIR_SECS:
+      _dir_listings[d] = mtime, ret
+    else:
+      _dir_listings.pop(d, None)
+  listings[d] = ret
+  return ret
+
+
+# Work tree (or dir if not in a repo) -> whether its FS is case-sensitive.
+_fs_case_sensitive = {}
+
+
+def fs_case_sensitive(repo=None):
+  """Returns True if the FS the repo is in is case-sensitive.
+
+  The FS is probed only the first time the repo is seen, the result is cached
+  for the lifetime of the process.
+
+  Args:
+    repo: the Repo to check (defaults to the repo at the cwd).
+  """
+  if repo:
+    return _fs_case_sensitive_at(repo.root or repo.path)
+  # Finding the work tree of the cwd takes a stat per parent dir, so we also
+  # cache the result by cwd.
+  cd = os.getcwd()
+  if cd not in _cwd_case_sensitive:
+    gd = git_dir()
+    _cwd_case_sensitive[cd] = _fs_case_sensitive_at(
+        gd[:-5] if gd else cd)  # Strip "/.git"
+  return _cwd_case_sensitive[cd]
+
+
+# Cwd -> whether the FS of its work tree (or of the cwd if not in a repo) is
+# case-sensitive.
+_cwd_case_sensitive = {}
+
+
+def _fs_case_sensitive_at(key):
+  if key not in _fs_case_sensitive:
+    _fs_case_sensitive[key] = _probe_case_sensitive(key)
+  return _fs_case_sensitive[key]
+
+
+def _probe_case_sensitive(d):
+  # We check if .git can also be found as .GIT. If d is not a repo, we do the
+  # same with the last component of d.
+  fp = os.path.join(d, '.git')
+  if not os.path.exists(fp):
+    fp = os.path.normpath(d)
+  fp_swapped = os.path.join(
+      os.path.dirname(fp), os.path.basename(fp).swapcase())
+  if fp_swapped == fp:
+    # Nothing to swap (e.g., d is /), assume case-sensitive.
+    return True
+  return not (
+      os.path.exists(fp_swapped) and os.path.samefile(fp, fp_swapped))
 
 
-def git_dir():
+def __getattr__(name):
+  # FS_CASE_SENSITIVE used to be computed on import, keep it for callers that
+  # still use it (Python 3.7+ only).
+  if name == 'FS_CASE_SENSITIVE':
+    return fs_case_sensitive()
+  raise AttributeError(
+      "module '{0}' has no attribute '{1}'".format(__name__, name))
+
+
+def cwd(repo=None):
+  """Gets the directory relative paths are relative to.
+
+  Returns:
+    the path the given Repo was opened at or the cwd if no Repo is given.
+  """
+  return repo.path if repo else os.getcwd()
+
+
+def git_dir(repo=None):
   """Gets the path to the .git directory
 
   Returns:
     the absolute path to the git directory or None if the current working
-    directory is not a Git repository.
+    directory (or the given Repo) is not a Git repository.
   """
-  cd = os.getcwd()
+  if repo:
+    return repo.git_dir
+  return _find_git_dir(os.getcwd())
+
+
+def repo_dir(repo=None):
+  """Gets the full path to the Git repo."""
+  if repo:
+    return repo.root
+  return git_dir()[:-4]  # Strip "/.git"
+
+
+def _find_git_dir(cd):
   ret = os.path.join(cd, '.git')
   while cd != '/':  # TODO(sperezde): windows support
     if os.path.isdir(ret):
@@ -99,9 +613,145 @@ def git_dir():
   return None
 
 
-def repo_dir():
-  """Gets the full path to the Git repo."""
-  return git_dir()[:-4]  # Strip "/.git"
+class Repo(object):
+  """A handle to a Git repository.
+
+  The handle resolves the location of the repo and reads its config only once,
+  so that functions that are given the handle (all module functions take an
+  optional repo argument) don't need to look these up again. Relative paths
+  given to those functions are relative to the path the repo was opened at.
+
+  The handle also owns the long-lived git processes used to query the repo
+  (like the object reader) and shuts them down when it is closed. It can also
+  be used as a context manager.
+
+  Attributes:
+    path: the absolute path of the directory the repo was opened at.
+    git_dir: the absolute path to the git directory or None if path is not
+      inside a Git repository.
+    root: the absolute path to the working tree of the repo.
+  """
+
+  def __init__(self, path=None):
+    self.path = os.path.abspath(path) if path else os.getcwd()
+    self.git_dir = _find_git_dir(self.path)
+    self.root = self.git_dir[:-5] if self.git_dir else None  # Strip "/.git"
+    self._config = None
+    self._reader = None
+    self._checker = None
+
+  def config(self, var):
+    """Gets the value of the given config var.
+
+    The whole config is read the first time a var is requested, subsequent
+    requests are answered from that snapshot (see refresh).
+
+    Args:
+      var: the name of the config var (e.g., 'status.relativePaths').
+
+    Returns:
+      the value of the var or None if it is not set.
+    """
+    if self._config is None:
+      self._config = _read_config(self)
+    return self._config.get(_config_key(var))
+
+  def refresh(self):
+    """Drops the config snapshot so that it is read again on the next use."""
+    self._config = None
+
+  @property
+  def reader(self):
+    """The cat_file.ObjectReader of this repo."""
+    if not self._reader:
+      from . import cat_file  # cat_file depends on common.
+      self._reader = cat_file.ObjectReader(cwd=self.path)
+    return self._reader
+
+  @property
+  def checker(self):
+    """The cat_file.ObjectChecker of this repo."""
+    if not self._checker:
+      from . import cat_file  # cat_file depends on common.
+      self._checker = cat_file.ObjectChecker(cwd=self.path)
+    return self._checker
+
+  def close(self):
+    """Shuts down all the git processes owned by this handle."""
+    if self._reader:
+      self._reader.close()
+      self._reader = None
+    if self._checker:
+      self._checker.close()
+      self._checker = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+def _read_config(repo):
+  ok, out, _ = git_call('config --list -z', repo=repo)
+  return _parse_config(out) if ok else {}
+
+
+def _parse_config(out):
+  ret = {}
+  for entry in out.split('\0'):
+    if not entry:
+      continue
+    # Each entry is in the form <key>LF<value>, vars set with no value don't
+    # have the LF (git config <var> outputs nothing for them).
+    key, _, value = entry.partition('\n')
+    ret[_config_key(key)] = value
+  return ret
+
+
+def _config_key(var):
+  # Section and var names are case-insensitive, subsection names are not.
+  section, _, rest = var.partition('.')
+  subsection, _, name = rest.rpartition('.')
+  if subsection:
+    return '{0}.{1}.{2}'.format(section.lower(), subsection, name.lower())
+  return '{0}.{1}'.format(section.lower(), name.lower())
+
+
+# Git dir -> (handle, mtime of its config file when the handle's config was
+# read).
+_default_repos = {}
+
+
+def default_repo():
+  """Gets the handle for the repo at the cwd.
+
+  Handles are shared by all callers that don't provide their own and are closed
+  when the interpreter exits. Handles are opened at the root of their work tree,
+  so they shouldn't be used to resolve paths relative to the cwd. Their config
+  is read again if the repo's config file changed since it was read.
+  """
+  gd = git_dir()
+  if not gd:
+    return Repo()
+  try:
+    mtime = os.stat(os.path.join(gd, 'config')).st_mtime
+  except OSError:
+    mtime = None
+  if gd not in _default_repos:
+    _default_repos[gd] = Repo(gd[:-5]), mtime  # Strip "/.git"
+  r, config_mtime = _default_repos[gd]
+  if config_mtime != mtime:
+    r.refresh()
+    _default_repos[gd] = r, mtime
+  return r
+
+
+@atexit.register
+def _close_default_repos():
+  for r, _ in _default_repos.values():
+    r.close()
+  _default_repos.clear()
 
 
 def remove_dups(list, key):
@@ -125,17 +775,18 @@ def remove_dups(list, key):
       yield a
 
 
-def get_all_fps_under_cwd():
+def get_all_fps_under_cwd(repo=None):
   """Returns a list of all existing filepaths under the cwd.
 
-  The filepaths returned are relative to the cwd. The Git directory (.git)
-  is ignored.
+  The filepaths returned are relative to the cwd (or to the path of the given
+  Repo). The Git directory (.git) is ignored.
   """
-  for dirpath, dirnames, filenames in os.walk(os.getcwd()):
+  start = cwd(repo=repo)
+  for dirpath, dirnames, filenames in os.walk(start):
     if '.git' in dirnames:
       dirnames.remove('.git')
     for fp in filenames:
-      yield os.path.relpath(os.path.join(dirpath, fp))
+      yield os.path.relpath(os.path.join(dirpath, fp), start)
 
 
 def items(dic):
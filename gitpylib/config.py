@@ -7,6 +7,8 @@
 from . import common
 
 
-def get(var):
+def get(var, repo=None):
+  if repo:
+    return repo.config(var)
   ok, out, _ = common.git_call('config {0}'.format(var))
   return out.strip() if ok else None
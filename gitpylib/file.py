@@ -4,9 +4,10 @@
 """Module for dealing with Git files."""
 
 
-import collections
+import itertools
 import os.path
 import re
+import sys
 
 from . import common
 
@@ -22,7 +23,7 @@ DIFF_ADDED = 6
 DIFF_MINUS = 7
 
 
-def stage(fp):
+def stage(fp, repo=None):
   """Stages the given file.
 
   Args:
@@ -32,16 +33,16 @@ def stage(fp):
     - SUCCESS: the operation completed successfully.
     - FILE_NOT_FOUND: the given file doesn't exist.
   """
-  if not os.path.exists(fp):
+  if not os.path.exists(os.path.join(common.cwd(repo=repo), fp)):
     return FILE_NOT_FOUND
 
-  fp = common.real_case(fp)
+  fp = common.real_case(fp, repo=repo)
 
-  common.safe_git_call('add "{0}"'.format(fp))
+  common.safe_git_call('add "{0}"'.format(fp), repo=repo)
   return SUCCESS
 
 
-def unstage(fp):
+def unstage(fp, repo=None):
   """Unstages the given file.
 
   Args:
@@ -50,7 +51,7 @@ def unstage(fp):
   Returns:
     - SUCCESS: the operation completed successfully.
   """
-  fp = common.real_case(fp)
+  fp = common.real_case(fp, repo=repo)
 
   # "git reset" currently returns 0 (if successful) while "git reset
   # $pathspec" returns 0 iff the index matches HEAD after resetting (on all
@@ -58,32 +59,167 @@ def unstage(fp):
   # http://comments.gmane.org/gmane.comp.version-control.git/211242.
   # So, we need to ignore the return code (unfortunately) and hope that it
   # works.
-  common.git_call('reset HEAD "{0}"'.format(fp))
+  common.git_call('reset HEAD "{0}"'.format(fp), repo=repo)
   return SUCCESS
 
 
-def show(fp, cp):
+def stage_many(fps, repo=None):
+  """Stages the given files.
+
+  All files are staged with one git process, no matter how many they are.
+
+  Args:
+    fps: the paths of the files to stage.
+
+  Returns:
+    a dict that maps each of the given paths to one of:
+    - SUCCESS: the file was staged successfully.
+    - FILE_NOT_FOUND: the file doesn't exist.
+  """
+  ret = {}
+  existing = []
+  for fp in fps:
+    if os.path.exists(os.path.join(common.cwd(repo=repo), fp)):
+      ret[fp] = SUCCESS
+      existing.append(fp)
+    else:
+      ret[fp] = FILE_NOT_FOUND
+  if existing:
+    common.safe_git_call(
+        'add --pathspec-from-file=- --pathspec-file-nul',
+        input='\0'.join(common.real_case_many(existing, repo=repo)),
+        repo=repo)
+  return ret
+
+
+def unstage_many(fps, repo=None):
+  """Unstages the given files.
+
+  All files are unstaged with one git process, no matter how many they are.
+
+  Args:
+    fps: the paths of the files to unstage.
+
+  Returns:
+    a dict that maps each of the given paths to SUCCESS.
+  """
+  fps = list(fps)
+  if fps:
+    # We ignore the return code for the same reason unstage does.
+    common.git_call(
+        'reset HEAD --pathspec-from-file=- --pathspec-file-nul',
+        input='\0'.join(common.real_case_many(fps, repo=repo)),
+        repo=repo)
+  return dict((fp, SUCCESS) for fp in fps)
+
+
+def show(fp, cp, binary=False, repo=None):
   """Gets the contents of file fp at commit cp.
 
   Args:
     fp: the file path to get contents from.
     cp: the commit point.
+    binary: if True, out are the raw bytes of the file. Otherwise, out is the
+      content decoded as UTF-8 (with undecodable bytes, like the ones in binary
+      files, replaced by U+FFFD).
+    repo: the common.Repo whose object reader to use (defaults to the repo at
+      the cwd).
 
   Returns:
     a pair (status, out) where status is one of FILE_NOT_FOUND_AT_CP or SUCCESS
     and out is the content of fp at cp.
   """
-  fp = common.real_case(fp)
+  return show_many([(fp, cp)], binary=binary, repo=repo)[0]
+
+
+def show_many(fps_cps, binary=False, repo=None):
+  """Gets the contents of many files at many commits.
+
+  All contents are read using the same git process.
+
+  Args:
+    fps_cps: a list of (fp, cp) pairs.
+    binary: whether to get the raw bytes of the files (see show).
+    repo: the common.Repo whose object reader to use (defaults to the repo at
+      the cwd).
+
+  Returns:
+    a list with the result of show for each (fp, cp) pair (in order).
+  """
+  ret = []
+  for obj in _repo(repo).reader.read_many(_objs(fps_cps, repo)):
+    if not obj or obj[0] != 'blob':
+      ret.append((FILE_NOT_FOUND_AT_CP, None))
+      continue
+    out = obj[1]
+    # Python 2/3 compatibility.
+    if not binary and sys.version > '3':
+      out = out.decode('utf-8', 'replace')
+    ret.append((SUCCESS, out))
+  return ret
+
+
+def show_to(fp, cp, fileobj, repo=None):
+  """Writes the contents of file fp at commit cp to a file.
+
+  The contents are copied in fixed-size chunks, so this should be used for
+  files that could be large.
+
+  Args:
+    fp: the file path to get contents from.
+    cp: the commit point.
+    fileobj: the binary file-like object to write the raw bytes of the file to.
+    repo: the common.Repo whose object reader to use (defaults to the repo at
+      the cwd).
+
+  Returns:
+    FILE_NOT_FOUND_AT_CP (nothing is written) or SUCCESS.
+  """
+  obj = _objs([(fp, cp)], repo)[0]
+  if not _repo(repo).reader.read_to(obj, fileobj, obj_type='blob'):
+    return FILE_NOT_FOUND_AT_CP
+  return SUCCESS
+
+
+def size(fp, cp, repo=None):
+  """Gets the size of file fp at commit cp (without reading its contents).
+
+  Args:
+    fp: the file path to get the size of.
+    cp: the commit point.
+    repo: the common.Repo whose object checker to use (defaults to the repo at
+      the cwd).
+
+  Returns:
+    a pair (status, size) where status is one of FILE_NOT_FOUND_AT_CP or
+    SUCCESS and size is the size of fp at cp in bytes.
+  """
+  return size_many([(fp, cp)], repo=repo)[0]
 
-  ok, out, _ = common.git_call('show {0}:"{1}"'.format(cp, fp))
 
-  if not ok:
-    return FILE_NOT_FOUND_AT_CP, None
+def size_many(fps_cps, repo=None):
+  """Gets the sizes of many files at many commits.
 
-  return SUCCESS, out
+  All sizes are read using the same git process.
 
+  Args:
+    fps_cps: a list of (fp, cp) pairs.
+    repo: the common.Repo whose object checker to use (defaults to the repo at
+      the cwd).
 
-def assume_unchanged(fp):
+  Returns:
+    a list with the result of size for each (fp, cp) pair (in order).
+  """
+  ret = []
+  for info in _repo(repo).checker.info_many(_objs(fps_cps, repo)):
+    if not info or info.type != 'blob':
+      ret.append((FILE_NOT_FOUND_AT_CP, None))
+    else:
+      ret.append((SUCCESS, info.size))
+  return ret
+
+
+def assume_unchanged(fp, repo=None):
   """Marks the given file as assumed unchanged.
 
   Args:
@@ -92,13 +228,14 @@ def assume_unchanged(fp):
   Returns:
     - SUCCESS: the operation completed successfully.
   """
-  fp = common.real_case(fp)
+  fp = common.real_case(fp, repo=repo)
 
-  common.safe_git_call('update-index --assume-unchanged "{0}"'.format(fp))
+  common.safe_git_call(
+      'update-index --assume-unchanged "{0}"'.format(fp), repo=repo)
   return SUCCESS
 
 
-def not_assume_unchanged(fp):
+def not_assume_unchanged(fp, repo=None):
   """Unmarks the given assumed unchanged file.
 
   Args:
@@ -107,13 +244,14 @@ def not_assume_unchanged(fp):
   Returns:
     - SUCCESS: the operation completed successfully.
   """
-  fp = common.real_case(fp)
+  fp = common.real_case(fp, repo=repo)
 
-  common.safe_git_call('update-index --no-assume-unchanged "{0}"'.format(fp))
+  common.safe_git_call(
+      'update-index --no-assume-unchanged "{0}"'.format(fp), repo=repo)
   return SUCCESS
 
 
-def diff(fp, staged=False):
+def diff(fp, staged=False, repo=None):
   """Compute the diff of the given file with its last committed version.
 
   Args:
@@ -122,89 +260,291 @@ def diff(fp, staged=False):
 
   Returns:
     a 4-tuple of:
-      - a list of namedtuples with fields 'line', 'status', 'old_line_number'
-      and 'new_line_number' where 'status' is one of DIFF_INFO, DIFF_SAME,
-      DIFF_ADDED or DIFF_MINUS and 'old_line_number', 'new_line_number'
-      correspond to the line's old line number and new line number respectively.
-      (Note that, for example, if the line is DIFF_ADDED, then 'old_line_number'
-      is None since that line is not present in the old file).
+      - a list of DiffLine objects with fields 'line', 'status',
+      'old_line_number' and 'new_line_number' where 'status' is one of
+      DIFF_INFO, DIFF_SAME, DIFF_ADDED or DIFF_MINUS and 'old_line_number',
+      'new_line_number' correspond to the line's old line number and new line
+      number respectively. (Note that, for example, if the line is DIFF_ADDED,
+      then 'old_line_number' is None since that line is not present in the old
+      file).
       - max_line_digits: the maximum amount of line digits found while parsing
       the git diff output, this is useful for padding.
       - number of lines added.
       - number of lines removed.
       - header (the diff header as a list of lines).
   """
-  fp = common.real_case(fp)
+  fp = common.real_case(fp, repo=repo)
 
   st = '--cached' if staged else ''
-  out, _ = common.safe_git_call('diff {0} -- "{1}"'.format(st, fp))
-  if not out:
+  out = common.git_stream(
+      '{0} diff {1} -- "{2}"'.format(_NO_QUOTE_PATH, st, fp), repo=repo)
+  ret = _process_diff(out)
+  if not ret[4]:  # No header means no changes.
     return [], 0, 0, 0, None
-  stats_out, _ = common.safe_git_call(
-      'diff {0} --numstat -- "{1}"'.format(st, fp))
-  header, body = _split_diff(out.splitlines())
-  line, padding = _process_diff_output(body)
-  additions, removals = _process_diff_stats_output(stats_out)
-  return line, padding, additions, removals, header
+  return ret
+
+
+def diff_many(fps, staged=False, repo=None):
+  """Compute the diff of the given files with their last committed version.
+
+  All diffs are computed with one git process and yielded as git produces
+  them.
+
+  Args:
+    fps: the paths of the files to diff.
+    staged: True if a staged diff should be done.
+
+  Yields:
+    (fp, diff) pairs for each file that has changes, where fp is the path of
+    the file (relative to the cwd) and diff is what diff would return for it.
+  """
+  fps = common.real_case_many(fps, repo=repo)
+  if not fps:
+    return
+  st = '--cached' if staged else ''
+  out = common.git_stream(
+      '{0} diff {1} -- "{2}"'.format(_NO_QUOTE_PATH, st, '" "'.join(fps)),
+      repo=repo)
+  repo_dir = common.repo_dir(repo=repo)
+  cwd = common.cwd(repo=repo)
+  for file_diff in _split_files(out):
+    _, fp_after = _diff_files(file_diff[0])
+    yield (
+        os.path.relpath(os.path.join(repo_dir, fp_after), cwd),
+        _process_diff(file_diff))
+
+
+class DiffLine(object):
+  """A line of a diff.
+
+  Behaves like a namedtuple with fields 'line', 'status', 'old_line_number' and
+  'new_line_number' (see diff), but takes less memory.
+  """
+
+  __slots__ = ('line', 'status', 'old_line_number', 'new_line_number')
+  _fields = __slots__
+
+  def __init__(self, line, status, old_line_number, new_line_number):
+    self.line = line
+    self.status = status
+    self.old_line_number = old_line_number
+    self.new_line_number = new_line_number
+
+  def __iter__(self):
+    yield self.line
+    yield self.status
+    yield self.old_line_number
+    yield self.new_line_number
+
+  def __len__(self):
+    return 4
+
+  def __getitem__(self, i):
+    return tuple(self)[i]
+
+  def __eq__(self, other):
+    if not isinstance(other, (DiffLine, tuple)):
+      return NotImplemented
+    return tuple(self) == tuple(other)
+
+  def __ne__(self, other):
+    eq = self.__eq__(other)
+    return eq if eq is NotImplemented else not eq
+
+  def __hash__(self):
+    return hash(tuple(self))
+
+  def __repr__(self):
+    return (
+        'DiffLine(line={0!r}, status={1!r}, old_line_number={2!r}, '
+        'new_line_number={3!r})'.format(*self))
 
 
 # Private functions.
 
 
+def _repo(repo):
+  # Paths are relative to the cwd if no repo is given, the default repo is only
+  # used for its cat-file processes.
+  return repo or common.default_repo()
+
+
+def _objs(fps_cps, repo):
+  """Gets the cat-file object names of the given (fp, cp) pairs."""
+  fps = common.real_case_many([fp for fp, _ in fps_cps], repo=repo)
+  return ['{0}:{1}'.format(cp, fp) for fp, (_, cp) in zip(fps, fps_cps)]
+
+
 def _split_diff(diff_out):
-  """Splits the diff output into the diff header and body."""
-  first_non_header_line = 0
-  for line in diff_out:
+  """Splits the diff output into the diff header and body.
+
+  Args:
+    diff_out: an iterable with the lines of the diff output (e.g., a
+      common.GitStream).
+
+  Returns:
+    a pair (header, body) where header is a list with the lines of the header
+    and body is an iterator over the rest of the lines (which are read as body
+    is consumed).
+  """
+  lines = iter(diff_out)
+  header = []
+  for line in lines:
     if line.startswith('@@'):
-      break
-    first_non_header_line += 1
-  return diff_out[:first_non_header_line], diff_out[first_non_header_line:]
+      return header, itertools.chain([line], lines)
+    header.append(line)
+  return header, iter(())
+
+
+def _split_files(diff_out):
+  """Splits the output of a multi-file diff into one diff per file.
+
+  Args:
+    diff_out: an iterable with the lines of the diff output.
+
+  Yields:
+    lists with the lines of the diff of each file.
+  """
+  curr = None
+  for line in diff_out:
+    if line.startswith('diff --git '):
+      if curr:
+        yield curr
+      curr = []
+    if curr is not None:
+      curr.append(line)
+  if curr:
+    yield curr
+
+
+# So that git only quotes paths with control chars, '"' or '\\' (see
+# _diff_files).
+_NO_QUOTE_PATH = '-c core.quotePath=false'
+
+
+def _diff_files(line):
+  """Gets the paths in the first line of the diff of a file.
+
+  Args:
+    line: the 'diff --git a/<fp_before> b/<fp_after>' line.
+
+  Returns:
+    a pair (fp_before, fp_after).
+  """
+  names = line[len('diff --git '):]
+  if not names.startswith('"') and not names.endswith('"'):
+    # If the file wasn't renamed we can split the line unambiguously even if
+    # the path has ' b/' in it.
+    n = (len(names) - 5) // 2
+    if (names[:2] == 'a/' and names[2 + n:5 + n] == ' b/' and
+        names[2:2 + n] == names[5 + n:]):
+      return names[2:2 + n], names[5 + n:]
+  result = _DIFF_FILES.match(line)
+  if not result:
+    raise common.UnexpectedOutputError('diff', line)
+  quoted_before, fp_before, quoted_after, fp_after = result.groups()
+  if quoted_before is not None:
+    fp_before = _unquote(quoted_before)
+  if quoted_after is not None:
+    fp_after = _unquote(quoted_after)
+  return fp_before, fp_after
+
+
+# Paths are quoted (C-style, in double quotes) if they have special chars.
+_DIFF_FILES = re.compile(
+    r'diff --git (?:"a/((?:[^"\\]|\\.)*)"|a/(.*)) '
+    r'(?:"b/((?:[^"\\]|\\.)*)"|b/(.*))$')
+
+_ESCAPES = {
+    b'a': b'\a', b'b': b'\b', b't': b'\t', b'n': b'\n', b'v': b'\v',
+    b'f': b'\f', b'r': b'\r'}
+
+
+def _unquote(s):
+  """Undoes git's quoting of a path (without the surrounding quotes)."""
+  # Python 2/3 compatibility.
+  if sys.version > '3':
+    s = s.encode('utf-8')
+  ret = bytearray()
+  i = 0
+  while i < len(s):
+    c = s[i:i + 1]
+    if c != b'\\':
+      ret += c
+      i += 1
+      continue
+    c = s[i + 1:i + 2]
+    if c.isdigit():
+      # The octal value of a byte (e.g., of a byte of a UTF-8 char).
+      ret.append(int(s[i + 1:i + 4], 8))
+      i += 4
+    else:
+      ret += _ESCAPES.get(c, c)
+      i += 2
+  return common._decode(bytes(ret))
+
+
+def _process_diff(diff_out):
+  """Processes the diff output of a file.
+
+  Args:
+    diff_out: an iterable with the lines of the diff output.
+
+  Returns:
+    the 5-tuple diff returns.
+  """
+  header, body = _split_diff(diff_out)
+  lines, padding, additions, removals = _process_diff_body(body)
+  return lines, padding, additions, removals, header
 
 
 def _process_diff_output(diff_out):
-  MIN_LINE_PADDING = 8
-  LineData = collections.namedtuple(
-      'LineData',
-      ['line', 'status', 'old_line_number', 'new_line_number'])
+  return _process_diff_body(diff_out)[:2]
+
+
+# @@ -(start of old),(length of old) +(start of new),(length of new) @@
+_NEW_HUNK = re.compile(r'@@ -([0-9]+)[,]?([0-9]*) \+([0-9]+)[,]?([0-9]*) @@')
 
+_MIN_LINE_PADDING = 8
+
+
+def _process_diff_body(diff_out):
   resulting = []  # accumulates line information for formatting.
+  append = resulting.append
   max_line_digits = 0
+  additions = 0
+  removals = 0
   old_line_number = 1
   new_line_number = 1
 
-  # @@ -(start of old),(length of old) +(start of new),(length of new) @@
-  new_hunk_regex = r'^@@ -([0-9]+)[,]?([0-9]*) \+([0-9]+)[,]?([0-9]*) @@'
   for line in diff_out:
-    new_hunk_info = re.search(new_hunk_regex, line)
-    if new_hunk_info:
-      get_info_or_zero = lambda g: 0 if g == '' else int(g)
-      old_line_number = get_info_or_zero(new_hunk_info.group(1))
-      old_diff_length = get_info_or_zero(new_hunk_info.group(2))
-      new_line_number = get_info_or_zero(new_hunk_info.group(3))
-      new_diff_length = get_info_or_zero(new_hunk_info.group(4))
-      resulting.append(
-          LineData(line, DIFF_INFO, old_line_number, new_line_number))
-      max_line_digits = max([old_line_number + old_diff_length,
-                             new_line_number + new_diff_length,
-                             max_line_digits])  # start + length of each diff.
-    elif line.startswith(' '):
-      resulting.append(
-          LineData(line, DIFF_SAME, old_line_number, new_line_number))
+    c = line[:1]
+    if c == ' ':
+      append(DiffLine(line, DIFF_SAME, old_line_number, new_line_number))
       old_line_number += 1
       new_line_number += 1
-    elif line.startswith('-'):
-      resulting.append(LineData(line, DIFF_MINUS, old_line_number, None))
-      old_line_number += 1
-    elif line.startswith('+'):
-      resulting.append(LineData(line, DIFF_ADDED, None, new_line_number))
+    elif c == '+':
+      append(DiffLine(line, DIFF_ADDED, None, new_line_number))
       new_line_number += 1
+      additions += 1
+    elif c == '-':
+      append(DiffLine(line, DIFF_MINUS, old_line_number, None))
+      old_line_number += 1
+      removals += 1
+    elif c == '@':
+      new_hunk_info = _NEW_HUNK.match(line)
+      if not new_hunk_info:
+        continue
+      old_start, old_len, new_start, new_len = new_hunk_info.groups()
+      old_line_number = int(old_start)
+      new_line_number = int(new_start)
+      append(DiffLine(line, DIFF_INFO, old_line_number, new_line_number))
+      # start + length of each diff.
+      max_line_digits = max(
+          old_line_number + (int(old_len) if old_len else 0),
+          new_line_number + (int(new_len) if new_len else 0),
+          max_line_digits)
 
   max_line_digits = len(str(max_line_digits))  # digits = len(string of number).
-  max_line_digits = max(MIN_LINE_PADDING, max_line_digits + 1)
-  return resulting, max_line_digits
-
-
-def _process_diff_stats_output(diff_stats_out):
-  # format is additions tab removals.
-  m = re.match(r'([0-9]+)\t([0-9]+)', diff_stats_out)
-  return int(m.group(1)), int(m.group(2))
+  max_line_digits = max(_MIN_LINE_PADDING, max_line_digits + 1)
+  return resulting, max_line_digits, additions, removals
@@ -11,17 +11,18 @@ import subprocess
 from . import common
 
 
-def pre_commit():
+def pre_commit(repo=None):
   """Runs the pre-commit hook."""
-  return _hook_call('pre-commit')
+  return _hook_call('pre-commit', repo=repo)
 
 
-def _hook_call(hook_name):
+def _hook_call(hook_name, repo=None):
   HookCall = collections.namedtuple('hook_call', ['ok', 'out', 'err'])
-  hook_path = '{0}/hooks/{1}'.format(common.git_dir(), hook_name)
+  hook_path = '{0}/hooks/{1}'.format(common.git_dir(repo=repo), hook_name)
   if not os.path.exists(hook_path):
     return HookCall(True, '', '')
   p = subprocess.Popen(
-      hook_path, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
+      hook_path, cwd=common.cwd(repo=repo), stdout=subprocess.PIPE,
+      stderr=subprocess.PIPE, shell=True)
   out, err = p.communicate()
   return HookCall(p.returncode == 0, out, err)
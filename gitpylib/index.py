@@ -0,0 +1,273 @@
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Module for reading the Git index (.git/index) in-process.
+
+Supports versions 2, 3 and 4 of the index file format. The file is mmap'ed and
+entries are decoded lazily: only the path and flags of an entry are decoded
+when iterating, everything else is decoded the first time it is accessed.
+"""
+
+
+import binascii
+import mmap
+import os
+import struct
+
+from . import common
+
+
+# Flags.
+ASSUME_VALID = 0x8000
+EXTENDED = 0x4000
+STAGE_MASK = 0x3000
+NAME_MASK = 0x0FFF
+
+# Extended flags (version 3 and up).
+SKIP_WORKTREE = 0x4000
+INTENT_TO_ADD = 0x2000
+
+# Tags of ls-files -v (see git manual for more info).
+TAG_CACHED = 'H'
+TAG_SKIP_WORKTREE = 'S'
+TAG_UNMERGED = 'M'
+
+# ctime, mtime (seconds and nanoseconds each), dev, ino, mode, uid, gid, size.
+_STAT = struct.Struct('>10I')
+_FLAGS = struct.Struct('>H')
+_HEADER = struct.Struct('>4sII')
+
+
+class UnsupportedIndexError(Exception):
+  """The index uses a feature this module can't read (callers should fall back
+  to asking git)."""
+
+
+class Index(object):
+  """A read-only view of an index file.
+
+  Can be used as a context manager, entries can't be accessed once the index is
+  closed.
+
+  Attributes:
+    version: the version of the index file format.
+  """
+
+  def __init__(self, path, oid_size=20):
+    self.version = 2
+    self._oid_size = oid_size
+    self._mmap = None
+    self._count = 0
+    try:
+      f = open(path, 'rb')
+    except IOError:
+      # No index yet (e.g., a new repo with nothing staged).
+      return
+    with f:
+      if not os.fstat(f.fileno()).st_size:
+        return
+      self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    signature, self.version, self._count = _HEADER.unpack_from(self._mmap, 0)
+    if signature != b'DIRC':
+      self.close()
+      raise common.UnexpectedOutputError('index', signature)
+    if self.version not in (2, 3, 4):
+      self.close()
+      raise UnsupportedIndexError(
+          'index version {0} is not supported'.format(self.version))
+
+  def __len__(self):
+    return self._count
+
+  def __iter__(self):
+    """Yields the IndexEntry objects in the index (in index order)."""
+    buf = self._mmap
+    if buf is None:
+      return
+    oid_size = self._oid_size
+    flags_off = 40 + oid_size
+    v4 = self.version == 4
+    offset = _HEADER.size
+    path = b''
+    for _ in range(self._count):
+      flags = _FLAGS.unpack_from(buf, offset + flags_off)[0]
+      name_off = flags_off + 2
+      ext_flags = 0
+      if flags & EXTENDED:
+        ext_flags = _FLAGS.unpack_from(buf, offset + name_off)[0]
+        name_off += 2
+      start = offset + name_off
+      if v4:
+        # The path is prefix-compressed: a varint with the number of bytes to
+        # remove from the end of the previous path, followed by the
+        # NUL-terminated suffix to append to it.
+        strip, start = _varint(buf, start)
+        end = buf.find(b'\0', start)
+        path = path[:len(path) - strip] + buf[start:end]
+        next_offset = end + 1
+      else:
+        name_len = flags & NAME_MASK
+        if name_len == NAME_MASK:
+          end = buf.find(b'\0', start)
+        else:
+          end = start + name_len
+        path = buf[start:end]
+        # Entries are padded with 1-8 NULs to a multiple of 8 bytes.
+        next_offset = offset + ((end - offset + 8) & ~7)
+      yield IndexEntry(self, offset, common._decode(path), flags, ext_flags)
+      offset = next_offset
+
+  def close(self):
+    if self._mmap is not None:
+      self._mmap.close()
+      self._mmap = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.close()
+
+
+class IndexEntry(object):
+  """An entry of the index.
+
+  Attributes:
+    path: the path of the entry (relative to the repo root).
+    flags: the entry's flags.
+    ext_flags: the entry's extended flags (0 if it has none).
+    ctime, mtime, dev, ino, mode, uid, gid, size: the entry's cached stat data
+      (ctime and mtime are (seconds, nanoseconds) pairs).
+    oid: the hex id of the entry's object.
+  """
+
+  __slots__ = ('_index', '_offset', '_stat', 'path', 'flags', 'ext_flags')
+
+  def __init__(self, index, offset, path, flags, ext_flags):
+    self._index = index
+    self._offset = offset
+    self._stat = None
+    self.path = path
+    self.flags = flags
+    self.ext_flags = ext_flags
+
+  @property
+  def stage(self):
+    return (self.flags & STAGE_MASK) >> 12
+
+  @property
+  def assume_valid(self):
+    return bool(self.flags & ASSUME_VALID)
+
+  @property
+  def skip_worktree(self):
+    return bool(self.ext_flags & SKIP_WORKTREE)
+
+  @property
+  def intent_to_add(self):
+    return bool(self.ext_flags & INTENT_TO_ADD)
+
+  @property
+  def tag(self):
+    """The tag ls-files -v would output for this entry."""
+    if self.stage:
+      tag = TAG_UNMERGED
+    elif self.skip_worktree:
+      tag = TAG_SKIP_WORKTREE
+    else:
+      tag = TAG_CACHED
+    return tag.lower() if self.assume_valid else tag
+
+  @property
+  def oid(self):
+    start = self._offset + 40
+    return common._decode(binascii.hexlify(
+        self._index._mmap[start:start + self._index._oid_size]))
+
+  @property
+  def ctime(self):
+    return self._stat_data()[0:2]
+
+  @property
+  def mtime(self):
+    return self._stat_data()[2:4]
+
+  @property
+  def dev(self):
+    return self._stat_data()[4]
+
+  @property
+  def ino(self):
+    return self._stat_data()[5]
+
+  @property
+  def mode(self):
+    return self._stat_data()[6]
+
+  @property
+  def uid(self):
+    return self._stat_data()[7]
+
+  @property
+  def gid(self):
+    return self._stat_data()[8]
+
+  @property
+  def size(self):
+    return self._stat_data()[9]
+
+  def _stat_data(self):
+    if self._stat is None:
+      self._stat = _STAT.unpack_from(self._index._mmap, self._offset)
+    return self._stat
+
+  def __repr__(self):
+    return 'IndexEntry({0!r}, tag={1!r})'.format(self.path, self.tag)
+
+
+def read(repo=None):
+  """Opens the index of the repo.
+
+  Args:
+    repo: the common.Repo whose index to read (defaults to the repo at the cwd).
+
+  Returns:
+    an Index.
+
+  Raises:
+    UnsupportedIndexError: if the index can't be read in-process (e.g., it is a
+      split or sparse index).
+  """
+  repo = repo or common.default_repo()
+  if repo.config('index.sparse') == 'true':
+    raise UnsupportedIndexError('sparse indexes are not supported')
+  gd = repo.git_dir
+  # A split index is only in use if there's a shared index file, the split
+  # index file alone doesn't have all the entries.
+  if any(f.startswith('sharedindex.') for f in os.listdir(gd)):
+    raise UnsupportedIndexError('split indexes are not supported')
+  object_format = repo.config('extensions.objectFormat')
+  oid_size = 32 if object_format == 'sha256' else 20
+  return Index(os.path.join(gd, 'index'), oid_size=oid_size)
+
+
+def _varint(buf, i):
+  """Decodes the offset varint of the index format starting at buf[i].
+
+  Returns:
+    a pair (value, index of the byte after the varint).
+  """
+  c = _byte(buf, i)
+  i += 1
+  val = c & 0x7F
+  while c & 0x80:
+    c = _byte(buf, i)
+    i += 1
+    val = ((val + 1) << 7) | (c & 0x7F)
+  return val, i
+
+
+def _byte(buf, i):
+  # Python 2/3 compatibility.
+  b = buf[i]
+  return b if isinstance(b, int) else ord(b)
@@ -0,0 +1,171 @@
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Module for finding out which git processes gitpylib runs and what they cost.
+
+Every git process gitpylib runs (including the long-lived cat-file ones and the
+ones run by aio) is reported, once it ends, to the hooks added with add_hook as
+a common.Call namedtuple (command line, timing, exit code, output sizes and the
+gitpylib function that ran it, along with where it was called from).
+
+profile collects the processes run while it is active, e.g.:
+
+  with instrument.profile() as prof:
+    status.of()
+  print(prof.summary())
+
+Hooks cost nothing when there are none.
+"""
+
+
+import collections
+import contextlib
+import shutil
+import tempfile
+import threading
+
+from . import common
+
+
+def add_hook(hook):
+  """Adds a hook.
+
+  Args:
+    hook: a function that is called with the common.Call of each git process
+      once it ends. It's called from the thread that ran the process (or from
+      the event loop's thread for aio) so it shouldn't block.
+  """
+  common._hooks.append(hook)
+
+
+def remove_hook(hook):
+  """Removes a hook added with add_hook."""
+  common._hooks.remove(hook)
+
+
+# Aggregated cost of a group of processes (see Profile).
+Cost = collections.namedtuple('Cost', ['count', 'secs', 'out_bytes'])
+
+
+class Profile(object):
+  """The git processes run while profiling (see profile).
+
+  Attributes:
+    calls: the common.Call of each process, in the order they ended.
+  """
+
+  def __init__(self, all_threads=False):
+    self.calls = []
+    self._lock = threading.Lock()
+    self._thread = None if all_threads else threading.current_thread()
+
+  def __call__(self, call):
+    # Processes run by threads gitpylib starts on behalf of this thread (see
+    # common._inheritable) are reported as run by this thread.
+    if self._thread and call.thread is not self._thread:
+      return
+    with self._lock:
+      self.calls.append(call)
+
+  @property
+  def count(self):
+    """The number of processes run."""
+    return len(self.calls)
+
+  @property
+  def secs(self):
+    """The total time the processes ran for (they can overlap)."""
+    return sum(c.secs for c in self.calls)
+
+  def by_api(self):
+    """Gets the Cost of the processes run by each gitpylib function.
+
+    Returns:
+      a dict that maps the name of each function (see common.Call) to a Cost.
+    """
+    return _group(self.calls, lambda c: c.api)
+
+  def by_command(self):
+    """Gets the Cost of the processes run for each git command.
+
+    Returns:
+      a dict that maps each git command (e.g., 'status') to a Cost.
+    """
+    return _group(self.calls, lambda c: _command(c.args))
+
+  def regions(self):
+    """Gets the time spent in each trace2 region (see profile).
+
+    Returns:
+      a dict that maps '<category>/<label>' to the total number of seconds
+      spent in the region across all processes.
+    """
+    ret = collections.defaultdict(float)
+    for c in self.calls:
+      for e in c.trace2 or ():
+        if e.get('event') == 'region_leave' and 't_rel' in e:
+          ret['{0}/{1}'.format(e.get('category'), e.get('label'))] += (
+              e['t_rel'])
+    return dict(ret)
+
+  def summary(self):
+    """Returns a human-readable summary of the processes run."""
+    lines = ['{0} git processes, {1:.3f}s'.format(self.count, self.secs)]
+    costs = sorted(
+        self.by_command().items(), key=lambda item: -item[1].secs)
+    for cmd, cost in costs:
+      lines.append('  {0:<20} {1:>5} {2:>9.3f}s {3:>12} bytes'.format(
+          cmd, cost.count, cost.secs, cost.out_bytes))
+    return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profile(all_threads=False, trace2=False):
+  """Collects the git processes run while the context is active.
+
+  Args:
+    all_threads: if True, the processes run by all threads are collected, not
+      only the ones run by this thread (and by the threads gitpylib starts on
+      its behalf).
+    trace2: if True, the processes are run with GIT_TRACE2_EVENT set and their
+      events are collected too (see common.Call and Profile.regions). This is
+      done for the processes run by all threads while the context is active.
+
+  Yields:
+    a Profile.
+  """
+  prof = Profile(all_threads=all_threads)
+  trace2_dir = tempfile.mkdtemp(prefix='gitpylib-trace2-') if trace2 else None
+  if trace2_dir:
+    common._trace2_dirs.append(trace2_dir)
+  add_hook(prof)
+  try:
+    yield prof
+  finally:
+    remove_hook(prof)
+    if trace2_dir:
+      common._trace2_dirs.remove(trace2_dir)
+      shutil.rmtree(trace2_dir, ignore_errors=True)
+
+
+# Private functions.
+
+
+def _group(calls, key):
+  ret = {}
+  for c in calls:
+    k = key(c)
+    count, secs, out_bytes = ret.get(k, (0, 0, 0))
+    ret[k] = Cost(count + 1, secs + c.secs, out_bytes + (c.out_bytes or 0))
+  return ret
+
+
+def _command(args):
+  """Gets the git command (e.g., 'status') of the given command line."""
+  args = iter(args[1:])  # Skip 'git'.
+  for a in args:
+    if a in ('-c', '-C'):
+      next(args, None)
+    elif not a.startswith('-'):
+      return a
+  return None
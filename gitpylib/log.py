@@ -3,7 +3,15 @@
 
 
 import collections
+import json
+import os
 import re
+import time
+
+try:
+  from collections.abc import Sequence as _Sequence
+except ImportError:
+  from collections import Sequence as _Sequence  # Python 2.
 
 from . import common
 from . import file as git_file
@@ -19,63 +27,280 @@ CommitDiff = collections.namedtuple(
   'CommitDiff', ['fp_before', 'fp_after', 'diff'])
 
 
-def log(include_diffs=False):
-  log_fmt = r'[[%H] [%an] [%ae] [%aD] [%ar]]%n%B'
-  out, _ = common.safe_git_call(
-      'log --format=format:"{0}" {1}'.format(
-        log_fmt, '-p' if include_diffs else ''))
-  return _parse_log_output(out)
-
-
-def _parse_log_output(out):
-  def _create_ci(m, msg, diffs):
-    processed_diffs = []
-    for diff in diffs:
-      fp_before, fp_after = re.match(
-          'diff --git a/(.*) b/(.*)', diff[0]).group(1, 2)
-      processed_diffs.append(
-          CommitDiff(
-            fp_before, fp_after,
-            git_file._process_diff_output(git_file._split_diff(diff)[1])))
-    return Commit(
-        m.group(1), CommitAuthor(*m.group(2, 3, 4, 5)), '\n'.join(msg),
-        processed_diffs)
-
-  if not out:
-    return []
-
-  pattern = re.compile(r'\[\[(.*)\] \[(.*)\] \[(.*)\] \[(.*)\] \[(.*)\]\]')
-  out_it = iter(out.splitlines())
-  m = None
-  msg = None
-  diffs = []
-  curr_diff = None
+def log(include_diffs=False, cache=False, repo=None):
+  """Gets the commits in the log.
+
+  Args:
+    include_diffs: whether to include the diffs of each commit or not.
+    cache: whether to use the on-disk cache of parsed commits or not (only used
+      if include_diffs is False). Only the commits that are not in the cache
+      yet are read from git.
+
+  Returns:
+    a list of Commit namedtuples, most recent first.
+  """
+  if cache and not include_diffs:
+    return _cached_log(repo)
+  return list(iter_log(include_diffs=include_diffs, repo=repo))
+
+
+def iter_log(
+    include_diffs=False, max_count=None, skip=None, since=None, until=None,
+    revs=None, paths=None, repo=None):
+  """Yields the commits in the log as git produces them.
+
+  Args:
+    include_diffs: whether to include the diffs of each commit or not.
+    max_count: if given, the max amount of commits to yield.
+    skip: if given, the amount of commits to skip before yielding any.
+    since: if given, only commits more recent than this date are yielded (any
+      date git understands, e.g., '2 weeks ago').
+    until: if given, only commits older than this date are yielded.
+    revs: if given, a list of revisions or revision ranges to walk from (e.g.,
+      ['master..topic']). Defaults to HEAD.
+    paths: if given, only commits that touch these paths are yielded.
+
+  Yields:
+    Commit namedtuples, most recent first.
+  """
+  out = common.git_stream(
+      _log_cmd(include_diffs, max_count, skip, since, until, revs, paths),
+      sep='\0', repo=repo)
+  return _parse_log(out)
+
+
+# Each commit starts with a NUL, followed by its NUL-terminated fields. NUL
+# can't appear in any field (or in the diff that follows the fields if diffs
+# are included), so the output can be split unambiguously.
+_LOG_FMT = '%x00%H%x00%an%x00%ae%x00%aD%x00%ar%x00%B%x00'
+_LOG_FIELDS = 7  # The 6 fields above plus whatever comes before the next NUL.
+
+
+def _log_cmd(include_diffs, max_count, skip, since, until, revs, paths):
+  """Builds the log command for iter_log."""
+  args = ['--format=format:"{0}"'.format(_LOG_FMT)]
+  if include_diffs:
+    args.append('-p')
+  if max_count is not None:
+    args.append('--max-count={0}'.format(int(max_count)))
+  if skip is not None:
+    args.append('--skip={0}'.format(int(skip)))
+  if since:
+    args.append('--since="{0}"'.format(since))
+  if until:
+    args.append('--until="{0}"'.format(until))
+  if revs:
+    args.extend(revs)
+  args.append('--')
+  if paths:
+    args.append('"{0}"'.format('" "'.join(paths)))
+  return '{0} log {1}'.format(git_file._NO_QUOTE_PATH, ' '.join(args))
+
+
+def _parse_log(records):
+  """Parses log output incrementally.
+
+  Args:
+    records: an iterable with the NUL-separated records of the log output.
+
+  Yields:
+    the commits in the output as soon as all their records have been read.
+  """
+  records = iter(records)
+  first = next(records, None)
+  if first:
+    raise common.UnexpectedOutputError('log', first)
+  fields = []
+  for r in records:
+    fields.append(r)
+    if len(fields) == _LOG_FIELDS:
+      yield _create_ci(fields)
+      fields = []
+  if len(fields) == _LOG_FIELDS - 1:
+    # The last commit has nothing after its last field.
+    fields.append('')
+    yield _create_ci(fields)
+  elif fields:
+    raise common.UnexpectedOutputError('log', '\0'.join(fields))
+
+
+def _create_ci(fields):
+  ci_id, name, email, date, date_relative, msg, diff_out = fields
+  if msg.endswith('\n'):
+    msg = msg[:-1]
+  return Commit(
+      ci_id, CommitAuthor(name, email, date, date_relative), msg,
+      _LazyDiffs(diff_out))
+
+
+class _LazyDiffs(_Sequence):
+  """The diffs of a commit.
+
+  The diff of each file is only parsed the first time it is accessed.
+  """
+
+  _FILE_START = re.compile(r'^diff --git ', re.M)
+
+  def __init__(self, diff_out):
+    self._diff_out = diff_out
+    self._starts = None
+    self._diffs = {}
+
+  def __len__(self):
+    return len(self._file_starts())
+
+  def __getitem__(self, i):
+    if isinstance(i, slice):
+      return [self[j] for j in range(*i.indices(len(self)))]
+    starts = self._file_starts()
+    if i < 0:
+      i += len(starts)
+    if not 0 <= i < len(starts):
+      raise IndexError('diff index out of range')
+    if i not in self._diffs:
+      end = starts[i + 1] if i + 1 < len(starts) else len(self._diff_out)
+      self._diffs[i] = _create_diff(
+          self._diff_out[starts[i]:end].splitlines())
+    return self._diffs[i]
+
+  def __eq__(self, other):
+    return list(self) == list(other)
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __repr__(self):
+    return repr(list(self))
+
+  def _file_starts(self):
+    if self._starts is None:
+      self._starts = [
+          m.start() for m in self._FILE_START.finditer(self._diff_out)]
+    return self._starts
+
+
+def _create_diff(diff):
+  fp_before, fp_after = git_file._diff_files(diff[0])
+  return CommitDiff(
+      fp_before, fp_after,
+      git_file._process_diff_output(git_file._split_diff(diff)[1]))
+
+
+# Cache of parsed commits.
+
+
+# Bump this if the format of the cache changes.
+_CACHE_VERSION = 1
+
+# Like _LOG_FMT but with the author timestamp instead of the relative date
+# (which changes over time and is computed when reading from the cache).
+_CACHE_FMT = '%x00%H%x00%an%x00%ae%x00%aD%x00%at%x00%B%x00'
+
+# Number of entries for commits not in the history of HEAD that the cache can
+# have (on top of as many as there are in the history of HEAD) before it's
+# pruned.
+_CACHE_SLACK = 10000
+
+
+def _cached_log(repo):
+  """Like log but reads the commits from the cache.
+
+  The cache maps commit ids to their parsed data. Since commits are immutable,
+  an entry never goes stale. The list of commits to return always comes from
+  rev-list, so rewritten history is never picked up from the cache.
+
+  Entries for commits that are not in the history of HEAD are kept (so that
+  switching branches doesn't evict the history of the other branch) until the
+  cache grows too large, at which point the commits that are not reachable from
+  any ref are dropped.
+  """
+  out, _ = common.safe_git_call('rev-list HEAD', repo=repo)
+  ids = out.split()
+  cache_fp = os.path.join(common.git_dir(repo=repo), 'gitpylib', 'log.json')
+  cache = _read_cache(cache_fp)
+
+  missing = [ci_id for ci_id in ids if ci_id not in cache]
+  if missing:
+    out, _ = common.safe_git_call(
+        'log --no-walk=unsorted --stdin --format=format:"{0}"'.format(
+            _CACHE_FMT),
+        input='\n'.join(missing) + '\n', repo=repo)
+    for ci in _parse_log(out.split('\0')):
+      cache[ci.id] = [
+          ci.author.name, ci.author.email, ci.author.date,
+          int(ci.author.date_relative), ci.msg]
+
+  now = time.time()
   ret = []
-  try:
-    line = next(out_it)
-    while True:
-      m = re.match(pattern, line)
-      if not m:
-        raise common.UnexpectedOutputError('log', line)
-      line = next(out_it)
-      msg = []
-      while not line.startswith('diff --git') and not line.startswith('[['):
-        msg.append(line)
-        line = next(out_it)
-      diffs = []
-      curr_diff = []
-      while not line.startswith('[['):
-        curr_diff.append(line)
-        line = next(out_it)
-        while not line.startswith('diff --git') and not line.startswith('[['):
-          curr_diff.append(line)
-          line = next(out_it)
-        diffs.append(curr_diff)
-        curr_diff = []
-
-      ret.append(_create_ci(m, msg, diffs))
-  except StopIteration:
-    if curr_diff:
-      diffs.append(curr_diff)
-    ret.append(_create_ci(m, msg, diffs))
+  for ci_id in ids:
+    name, email, date, timestamp, msg = cache[ci_id]
+    ret.append(Commit(
+        ci_id,
+        CommitAuthor(name, email, date, _relative_date(timestamp, now)),
+        msg, _LazyDiffs('')))
+
+  if len(cache) > 2 * len(ids) + _CACHE_SLACK:
+    out, _ = common.safe_git_call('rev-list --all', repo=repo)
+    cache = dict(
+        (ci_id, cache[ci_id]) for ci_id in out.split() if ci_id in cache)
+  elif not missing:
+    return ret
+  _write_cache(cache_fp, cache)
   return ret
+
+
+def _read_cache(cache_fp):
+  try:
+    with open(cache_fp) as f:
+      data = json.load(f)
+  except (IOError, ValueError):
+    # No cache yet or it is corrupt.
+    return {}
+  if data.get('version') != _CACHE_VERSION:
+    return {}
+  return data['commits']
+
+
+def _write_cache(cache_fp, commits):
+  d = os.path.dirname(cache_fp)
+  if not os.path.isdir(d):
+    os.makedirs(d)
+  # Write to a temp file first so that readers never see a partial cache.
+  tmp_fp = '{0}.{1}.tmp'.format(cache_fp, os.getpid())
+  with open(tmp_fp, 'w') as f:
+    json.dump({'version': _CACHE_VERSION, 'commits': commits}, f)
+  os.rename(tmp_fp, cache_fp)
+
+
+def _relative_date(timestamp, now):
+  """Formats the given timestamp like git's --date=relative does."""
+  diff = int(now) - timestamp
+  if diff < 0:
+    return 'in the future'
+  if diff < 90:
+    return _plural(diff, 'second') + ' ago'
+  diff = (diff + 30) // 60  # Minutes.
+  if diff < 90:
+    return _plural(diff, 'minute') + ' ago'
+  diff = (diff + 30) // 60  # Hours.
+  if diff < 36:
+    return _plural(diff, 'hour') + ' ago'
+  diff = (diff + 12) // 24  # Days.
+  if diff < 14:
+    return _plural(diff, 'day') + ' ago'
+  if diff < 70:
+    return _plural((diff + 3) // 7, 'week') + ' ago'
+  if diff < 365:
+    return _plural((diff + 15) // 30, 'month') + ' ago'
+  if diff < 1825:
+    total_months = (diff * 12 * 2 + 365) // (365 * 2)
+    years, months = divmod(total_months, 12)
+    if months:
+      return '{0}, {1} ago'.format(
+          _plural(years, 'year'), _plural(months, 'month'))
+    return _plural(years, 'year') + ' ago'
+  return _plural((diff + 183) // 365, 'year') + ' ago'
+
+
+def _plural(n, unit):
+  return '{0} {1}{2}'.format(n, unit, '' if n == 1 else 's')
@@ -0,0 +1,176 @@
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Module for running queries over many repos in parallel.
+
+Each query is given the common.Repo of its repo, so there's no need to chdir
+into the repos (all module functions take an optional repo argument), e.g.:
+
+  for r in multi.run(lambda repo: list(status.of(repo=repo)), paths):
+    if r.error:
+      print('{0} failed: {1}'.format(r.path, r.error))
+"""
+
+
+import collections
+import threading
+import time
+
+from . import common
+
+try:
+  import queue
+except ImportError:
+  import Queue as queue  # Python 2.
+
+
+Result = collections.namedtuple('Result', ['path', 'value', 'error'])
+
+
+class QueryTimeout(Exception):
+  """The query took longer than the timeout given to run."""
+
+
+class NotARepoError(Exception):
+  """The path given to run is not in a Git repo."""
+
+
+def run(query, paths, jobs=8, timeout=None):
+  """Runs query on each of the repos at the given paths.
+
+  Queries run in a pool of jobs threads, so at most jobs repos are queried at
+  the same time (and thus, unless the query itself runs things in parallel, at
+  most jobs git processes are run at the same time).
+
+  Args:
+    query: a function that takes a common.Repo and returns the result for that
+      repo (e.g., lambda repo: list(branch.status_all(repo=repo))).
+    paths: the paths of the repos to run query on.
+    jobs: the number of repos to query at the same time.
+    timeout: if given, the max number of seconds the query of one repo can
+      take. The git processes of a query that times out are killed (and so are
+      the ones it starts from then on). Only the processes started from the
+      thread that runs the query (or from threads that inherit its state, like
+      the ones branch.divergence starts, see common._inheritable) are killed.
+
+  Yields:
+    Result namedtuples (path, value, error) as each repo finishes, where value
+    is what query returned (or None if it failed) and error is the exception it
+    raised (a QueryTimeout if it timed out, a NotARepoError if the path is not
+    in a Git repo) or None if it succeeded. Paths given more than once are
+    queried (and yielded) once per time they were given.
+  """
+  if jobs < 1:
+    raise ValueError('jobs must be at least 1, got {0}'.format(jobs))
+  paths = list(paths)
+  todo = queue.Queue()
+  for task in enumerate(paths):
+    todo.put(task)
+  done = queue.Queue()
+  lock = threading.Lock()
+  # Index of the task -> (path, deadline, proc group) of the repos being
+  # queried.
+  running = {}
+  # The queries are run on behalf of this thread (see instrument.profile).
+  owner = common._inheritable()['thread']
+
+  def work():
+    common._local.thread = owner
+    while True:
+      try:
+        i, path = todo.get_nowait()
+      except queue.Empty:
+        return
+      group = common._ProcGroup()
+      deadline = time.time() + timeout if timeout else None
+      with lock:
+        running[i] = path, deadline, group
+      common._local.proc_group = group
+      try:
+        result = Result(path, _query(query, path), None)
+      except Exception as e:
+        result = Result(path, None, e)
+      finally:
+        common._local.proc_group = None
+      with lock:
+        if running.pop(i, None) is None:
+          # It timed out, the timeout was already reported.
+          continue
+      done.put(result)
+
+  for _ in range(min(jobs, len(paths))):
+    t = threading.Thread(target=work)
+    t.daemon = True
+    t.start()
+
+  pending = len(paths)
+  try:
+    while pending:
+      try:
+        result = done.get(timeout=_wait_secs(running, lock, timeout))
+      except queue.Empty:
+        for result in _expired(running, lock):
+          pending -= 1
+          yield result
+        continue
+      pending -= 1
+      yield result
+  finally:
+    if pending:
+      # The caller stopped before all repos finished, we don't query the ones
+      # that haven't started and kill the queries that are still running.
+      while not todo.empty():
+        try:
+          todo.get_nowait()
+        except queue.Empty:
+          break
+      with lock:
+        groups = [group for _, _, group in running.values()]
+        running.clear()
+      for group in groups:
+        group.kill()
+
+
+# Private functions.
+
+
+# How long to wait for results before checking for timeouts again when no repo
+# is being queried yet.
+_POLL_SECS = 0.1
+
+
+def _query(query, path):
+  with common.Repo(path) as repo:
+    if not repo.git_dir:
+      raise NotARepoError('{0} is not in a Git repo'.format(path))
+    return query(repo)
+
+
+def _wait_secs(running, lock, timeout):
+  """How long to wait for the next result before checking for timeouts."""
+  if not timeout:
+    return None
+  with lock:
+    deadlines = [deadline for _, deadline, _ in running.values()]
+  if not deadlines:
+    return _POLL_SECS
+  return max(0, min(deadlines) - time.time())
+
+
+def _expired(running, lock):
+  """Kills the queries that timed out.
+
+  Yields:
+    a Result for each of them.
+  """
+  now = time.time()
+  with lock:
+    expired = [
+        (i, path, group) for i, (path, deadline, group)
+        in common.items(running) if deadline <= now]
+    for i, _, _ in expired:
+      del running[i]
+  for _, path, group in expired:
+    group.kill()
+    yield Result(path, None, QueryTimeout(
+        'query of {0} timed out'.format(path)))
@@ -6,6 +6,8 @@
 
 import collections
 import re
+import threading
+import time
 
 from . import common
 
@@ -15,11 +17,16 @@ REMOTE_NOT_FOUND = 2
 REMOTE_UNREACHABLE = 3
 REMOTE_BRANCH_NOT_FOUND = 4
 
+# Max number of seconds a snapshot of the refs of a remote is reused for by
+# refs (and thus head_exist) by default.
+REFS_TTL = 30
 
-def add(remote_name, remote_url):
+
+def add(remote_name, remote_url, repo=None):
   """Adds the given remote.
 
-  Adds the remote mapping and also does a fetch.
+  Adds the remote mapping and also does a fetch. The fetch is what tells us
+  whether the remote is reachable, if it fails the mapping is removed.
 
   Args:
     remote_name: the name of the remote to add.
@@ -28,14 +35,21 @@ def add(remote_name, remote_url):
   Returns:
     SUCCESS or REMOTE_UNREACHABLE.
   """
-  if _show(remote_url)[0] == REMOTE_UNREACHABLE:
-    return REMOTE_UNREACHABLE
-  common.safe_git_call('remote add {0} {1}'.format(remote_name, remote_url))
-  common.safe_git_call('fetch {0}'.format(remote_name))
-  return SUCCESS
+  common.safe_git_call(
+      'remote add {0} {1}'.format(remote_name, remote_url), repo=repo)
+  try:
+    ret = _fetch(remote_name, repo)
+  except BaseException:
+    rm(remote_name, repo=repo)
+    raise
+  if ret == REMOTE_UNREACHABLE:
+    rm(remote_name, repo=repo)
+  elif repo:
+    repo.refresh()
+  return ret
 
 
-def show(remote_name):
+def show(remote_name, repo=None):
   """Get information about the given remote.
 
   Args:
@@ -45,14 +59,14 @@ def show(remote_name):
     a tuple (status, out) where status is one of SUCCESS, REMOTE_NOT_FOUND, or
     REMOTE_UNREACHABLE and out is the output of the show command on success.
   """
-  if remote_name not in show_all():
+  if not _exists(remote_name, repo):
     return REMOTE_NOT_FOUND, None
-  return _show(remote_name)
+  return _show(remote_name, repo=repo)
 
 
-def show_all():
+def show_all(repo=None):
   """Get information of all the remotes."""
-  out, _ = common.safe_git_call('remote')
+  out, _ = common.safe_git_call('remote', repo=repo)
   return out.splitlines()
 
 
@@ -60,9 +74,129 @@ RemoteInfo = collections.namedtuple(
     'RemoteInfo', ['name', 'fetch', 'push'])
 
 
-def show_all_v():
+def show_all_v(repo=None):
   """Get information of all the remotes (verbose)."""
-  out, _ = common.safe_git_call('remote -v')
+  out, _ = common.safe_git_call('remote -v', repo=repo)
+  return _parse_remote_v(out)
+
+
+def rm(remote_name, repo=None):
+  common.safe_git_call('remote rm {0}'.format(remote_name), repo=repo)
+  if repo:
+    repo.refresh()
+
+
+def fetch_all(names=None, jobs=8, repo=None):
+  """Fetches the given remotes, several of them at the same time.
+
+  Args:
+    names: the names of the remotes to fetch (defaults to all remotes).
+    jobs: the max number of fetches to run at the same time.
+
+  Returns:
+    a dict that maps each of the given names to SUCCESS, REMOTE_NOT_FOUND or
+    REMOTE_UNREACHABLE.
+  """
+  if jobs < 1:
+    raise ValueError('jobs must be at least 1, got {0}'.format(jobs))
+  names = list(show_all(repo=repo) if names is None else names)
+  ret = {}
+  todo = []
+  for name in names:
+    if _exists(name, repo):
+      todo.append(name)
+    else:
+      ret[name] = REMOTE_NOT_FOUND
+  if not todo:
+    return ret
+
+  lock = threading.Lock()
+  errors = []
+  # So that the fetches are killed if the caller's processes are (see
+  # multi.run).
+  state = common._inheritable()
+
+  def run():
+    while True:
+      with lock:
+        if not todo:
+          return
+        name = todo.pop()
+      try:
+        with common._inherited(state):
+          result = _fetch(name, repo)
+      except Exception as e:
+        errors.append(e)
+        return
+      with lock:
+        ret[name] = result
+
+  threads = [
+      threading.Thread(target=run) for _ in range(min(jobs, len(todo)) - 1)]
+  for t in threads:
+    t.start()
+  run()  # This thread also fetches.
+  for t in threads:
+    t.join()
+  if errors:
+    raise errors[0]
+  return ret
+
+
+def refs(remote_name, max_age=None, repo=None):
+  """Gets the branches and tags of the given remote as the remote sees them.
+
+  The refs are listed with one ls-remote (which talks to the remote) and the
+  snapshot is reused by later calls until it gets older than max_age.
+
+  Args:
+    remote_name: the name of the remote.
+    max_age: the max number of seconds a snapshot can be reused for (defaults
+      to REFS_TTL). Use 0 to always talk to the remote (see refresh_refs).
+
+  Returns:
+    None if the remote is unreachable or a dict that maps the full name of each
+    ref (e.g., 'refs/heads/master') to the id of the object it points to.
+  """
+  key = _refs_key(remote_name, repo)
+  ret = _cached_refs(key, max_age)
+  if ret is None:
+    ok, out, _ = common.git_call(
+        _LS_REMOTE_CMD.format(remote_name), repo=repo)
+    if not ok:
+      return None
+    ret = _store_refs(key, out)
+  return ret
+
+
+def refresh_refs(remote_name, repo=None):
+  """Takes a new snapshot of the refs of the given remote (see refs)."""
+  return refs(remote_name, max_age=0, repo=repo)
+
+
+def head_exist(remote_name, head, repo=None):
+  """Checks whether the given remote has a branch named head (see refs)."""
+  remote_refs = refs(remote_name, repo=repo)
+  if remote_refs is None:
+    return False, REMOTE_UNREACHABLE
+  return 'refs/heads/' + head in remote_refs, REMOTE_BRANCH_NOT_FOUND
+
+
+def branches(remote_name, repo=None):
+  """Gets the name of the branches in the given remote.
+
+  These are the remote-tracking branches of the remote, i.e., the branches
+  that the remote had when it was last fetched.
+  """
+  out, _ = common.safe_git_call(
+      _BRANCHES_CMD.format(remote_name), repo=repo)
+  return _parse_branches(remote_name, out)
+
+
+# Private functions.
+
+
+def _parse_remote_v(out):
   # format is remote_name  url (fetch/push)
   pattern = r'(\w+)\s+(.+)\s+\((\w+)\)'
   ret = {}
@@ -80,37 +214,78 @@ def show_all_v():
       RemoteInfo(rn, ret[rn]['fetch'], ret[rn]['push']) for rn in ret.keys()]
 
 
-def rm(remote_name):
-  common.safe_git_call('remote rm {0}'.format(remote_name))
+_BRANCHES_CMD = 'for-each-ref --format=%(refname) "refs/remotes/{0}/"'
 
+_LS_REMOTE_CMD = 'ls-remote --heads --tags {0}'
 
-def head_exist(remote_name, head):
-  ok, out, _ = common.git_call(
-      'ls-remote --heads {0} {1}'.format(remote_name, head))
-  if not ok:
-    return False, REMOTE_UNREACHABLE
-  return len(out) > 0, REMOTE_BRANCH_NOT_FOUND
+# (git dir, remote name, remote url) -> (time it was taken, refs) of the
+# snapshots taken by refs.
+_refs_cache = {}
+_refs_lock = threading.Lock()
 
 
-def branches(remote_name):
-  """Gets the name of the branches in the given remote."""
-  out, _ = common.safe_git_call('branch -r')
-  remote_name_len = len(remote_name)
+def _parse_branches(remote_name, out):
+  prefix_len = len('refs/remotes/{0}/'.format(remote_name))
   for line in out.splitlines():
-    if '->' in line:
-      continue
-    line = line.strip()
-    if line.startswith(remote_name):
-      yield line[remote_name_len+1:]
+    name = line[prefix_len:]
+    if name != 'HEAD':  # The symbolic ref to the remote's default branch.
+      yield name
 
 
-# Private functions.
+def _refs_key(remote_name, repo):
+  # The url is part of the key so that we don't reuse the snapshot of a remote
+  # that has since been removed and re-added with another url.
+  r = repo or common.default_repo()
+  return r.git_dir, remote_name, r.config('remote.{0}.url'.format(remote_name))
+
+
+def _cached_refs(key, max_age):
+  if max_age is None:
+    max_age = REFS_TTL
+  with _refs_lock:
+    entry = _refs_cache.get(key)
+  if not entry or time.time() - entry[0] >= max_age:
+    return None
+  return entry[1]
+
+
+def _store_refs(key, out):
+  # Each line is in the form <object id>TAB<ref name>.
+  ret = {}
+  for line in out.splitlines():
+    obj, _, name = line.partition('\t')
+    ret[name] = obj
+  with _refs_lock:
+    _refs_cache[key] = time.time(), ret
+  return ret
+
+
+def _exists(remote_name, repo):
+  # Every remote has a url, reading it from the config doesn't need a git
+  # process once the config is loaded.
+  r = repo or common.default_repo()
+  return r.config('remote.{0}.url'.format(remote_name)) is not None
+
+
+def _unreachable(err):
+  return (
+      'fatal: Could not read from remote repository' in err or
+      'fatal: unable to access' in err)
+
+
+def _fetch(remote_name, repo):
+  ok, out, err = common.git_call('fetch {0}'.format(remote_name), repo=repo)
+  if not ok:
+    if _unreachable(err):
+      return REMOTE_UNREACHABLE
+    raise common.UnexpectedOutputError('fetch', out, err=err)
+  return SUCCESS
 
 
-def _show(remote):
-  ok, out, err = common.git_call('remote show {0}'.format(remote))
+def _show(remote, repo=None):
+  ok, out, err = common.git_call('remote show {0}'.format(remote), repo=repo)
   if not ok:
-    if 'fatal: Could not read from remote repository' in err:
+    if _unreachable(err):
       return REMOTE_UNREACHABLE, None
     raise common.UnexpectedOutputError('remote', out, err=err)
   return SUCCESS, out
@@ -0,0 +1,66 @@
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Module for resolving revision expressions to objects.
+
+Names are resolved by the repo's persistent cat-file process (see
+cat_file.ObjectChecker), so many of them can be validated in one round trip
+before running the commands that use them, e.g.:
+
+  resolved = rev.resolve_many([sp, src])
+  invalid = [n for n, r in zip([sp, src], resolved) if not r]
+"""
+
+
+import collections
+
+from . import common
+
+
+# The object a revision expression names.
+Resolved = collections.namedtuple('Resolved', ['id', 'type'])
+
+
+def resolve(name, repo=None):
+  """Resolves the given revision expression.
+
+  Args:
+    name: any expression that names an object (e.g., 'master', 'HEAD~2',
+      'v1.0^{commit}' or 'HEAD:paper.tex', where paths are relative to the root
+      of the repo).
+    repo: the common.Repo whose object checker to use (defaults to the repo at
+      the cwd).
+
+  Returns:
+    None if the name doesn't name an object (or is ambiguous) or a Resolved
+    namedtuple (id, type) with the id of the object and its type (e.g.,
+    'commit').
+  """
+  return resolve_many([name], repo=repo)[0]
+
+
+def resolve_many(names, repo=None):
+  """Resolves the given revision expressions in one round trip.
+
+  Args:
+    names: a list of expressions to resolve.
+    repo: the common.Repo whose object checker to use (defaults to the repo at
+      the cwd).
+
+  Returns:
+    a list with the result of resolve for each of the given names (in order).
+  """
+  names = list(names)
+  # cat-file reads one name per line, names with a newline can't be valid.
+  valid = [n for n in names if '\n' not in n]
+  checker = (repo or common.default_repo()).checker
+  infos = iter(checker.info_many(valid))
+  return [
+      _resolved(next(infos)) if '\n' not in n else None for n in names]
+
+
+# Private functions.
+
+
+def _resolved(info):
+  return Resolved(info.id, info.type) if info else None
@@ -9,7 +9,7 @@ from . import common
 import re
 
 
-def all(msg):
+def all(msg, repo=None):
   """Creates a stash with the given msg that contains all local changes.
 
   This will add to the stash both the untracked and ignored files.
@@ -17,36 +17,36 @@ def all(msg):
   Args:
     msg: the msg for the stash to create.
   """
-  common.safe_git_call('stash save --all -- "{0}"'.format(msg))
+  common.safe_git_call('stash save --all -- "{0}"'.format(msg), repo=repo)
 
 
-def pop(msg):
+def pop(msg, repo=None):
   """Pop the stash that has the given msg (if found).
 
   Args:
     msg: the message corresponding to the stash to pop.
   """
-  s_id = _stash_id(msg)
+  s_id = _stash_id(msg, repo=repo)
   if not s_id:
     return
 
-  common.safe_git_call('stash pop {0}'.format(s_id))
+  common.safe_git_call('stash pop {0}'.format(s_id), repo=repo)
 
 
-def drop(msg):
+def drop(msg, repo=None):
   """Drop the stash that has the given msg (if found).
 
   Args:
     msg: the message corresponding to the stash to drop.
   """
-  s_id = _stash_id(msg)
+  s_id = _stash_id(msg, repo=repo)
   if not s_id:
     return
 
-  common.safe_git_call('stash drop {0}'.format(s_id))
+  common.safe_git_call('stash drop {0}'.format(s_id), repo=repo)
 
 
-def _stash_id(msg):
+def _stash_id(msg, repo=None):
   """Gets the stash id of the stash with the given msg.
 
   Args:
@@ -56,7 +56,8 @@ def _stash_id(msg):
     the stash id of the stash with the given msg or None if no matching stash is
     found.
   """
-  out, _ = common.safe_git_call('stash list --grep=": {0}"'.format(msg))
+  out, _ = common.safe_git_call(
+      'stash list --grep=": {0}"'.format(msg), repo=repo)
 
   if not out:
     return None
@@ -5,76 +5,349 @@
 
 
 import os
+import re
 
 from . import common
 from . import config
+from . import index as git_index
 
 
-def of_file(fp):
+def of_file(fp, repo=None, snapshot=None):
   """Gets the status of the given file.
 
   Args:
     fp: the path of the file to status (e.g., 'paper.tex').
+    snapshot: if given, the Snapshot to get the status from (no git process is
+      run).
 
   Returns:
     None if the given file doesn't exist or one of the possible status codes.
   """
-  return next(of(only_paths=[fp]), (None, None))[1]
+  if snapshot:
+    return snapshot.of_file(fp)
+  return next(of(only_paths=[fp], repo=repo), (None, None))[1]
 
 
-def of(only_paths=None, relative_paths=None):
-  """Status of the repo or of the only_paths given.
+def of_files(fps, repo=None):
+  """Gets the status of the given files.
+
+  The status of all files is computed at once (instead of once per file).
+
+  Args:
+    fps: the paths of the files to status.
 
   Returns:
-    A list of (fp, status) pairs. fp is a file path and status is a two or three
-    letter code corresponding to the output from status porcelain and ls-files
-    (see git manual for more info).
+    a dict that maps each of the given paths to None if the file doesn't exist
+    or to one of the possible status codes.
+  """
+  fps = list(fps)
+  ret = dict((fp, None) for fp in fps)
+  # Results are keyed by the path relative to the repo root since fps could be
+  # given in different ways (e.g., absolute or relative to the cwd).
+  to_root = _root_relative(repo)
+  root_fps = {}
+  for fp in fps:
+    root_fps.setdefault(to_root(fp), []).append(fp)
+  for chunk in _chunks([same[0] for same in root_fps.values()]):
+    for fp, s in _of_root(chunk, repo):
+      for orig_fp in root_fps.get(fp, []):
+        ret[orig_fp] = s
+  return ret
+
+
+class Snapshot(object):
+  """The status of the repo (or of some paths) at one point in time.
+
+  Useful for operations that need the status of many files one at a time (see
+  of_file): the status is computed once, when the snapshot is taken, and later
+  lookups don't run any git process.
+
+  If a watch.Watcher is given, the snapshot can be brought up to date with
+  refresh, which only recomputes the status of the paths that changed since
+  the snapshot was taken (or last refreshed).
+  """
+
+  def __init__(self, only_paths=None, repo=None, watcher=None):
+    self._only_paths = only_paths
+    self._repo = repo
+    self._watcher = watcher
+    self._matches = _matcher(only_paths, repo)
+    self._to_root = _root_relative(repo)
+    self._token = watcher.token() if watcher else None
+    # Keyed by the path relative to the repo root (see of_files).
+    self._status = self._of(only_paths)
+
+  def of_file(self, fp):
+    """Gets the status of the given file (see status.of_file)."""
+    return self._status.get(self._to_root(fp))
+
+  def __iter__(self):
+    """Yields (fp, status) pairs like status.of does."""
+    fix_fp = _fp_fixer(True, self._repo)
+    for fp, s in common.items(self._status):
+      yield fix_fp(fp), s
+
+  def refresh(self):
+    """Brings the snapshot up to date (requires a watcher)."""
+    self._token, changed = self._watcher.changed_since(self._token)
+    if changed is None:
+      self._status = self._of(self._only_paths)
+      return
+
+    changed = [fp for fp in changed if self._matches(fp)]
+    if not changed:
+      return
+    # Changed paths could be dirs, we drop everything under them too.
+    dirs = tuple(fp + '/' for fp in changed)
+    for fp in list(self._status.keys()):
+      if fp in changed or fp.startswith(dirs):
+        del self._status[fp]
+    repo_dir = common.repo_dir(repo=self._repo)
+    for chunk in _chunks([os.path.join(repo_dir, fp) for fp in changed]):
+      self._status.update(self._of(chunk))
+
+  def _of(self, only_paths):
+    return dict(_of_root(only_paths, self._repo))
+
+
+def of(only_paths=None, relative_paths=None, repo=None):
+  """Status of the repo or of the only_paths given.
+
+  Results are yielded as git produces them, the output of git is never
+  buffered as a whole.
+
+  Yields:
+    (fp, status) pairs. fp is a file path and status is a two or three letter
+    code corresponding to the output from status porcelain and ls-files (see git
+    manual for more info).
   """
   if not relative_paths:
-    c = config.get('status.relativePaths')
+    c = config.get('status.relativePaths', repo=repo)
     relative_paths = c if c else True  # git seems to default to true
 
-  if only_paths:
-    pathspecs = '"' + '" "'.join(only_paths) + '"'
-  else:
-    pathspecs = common.repo_dir()
-
-  ret = {}
-  repo_dir = common.repo_dir()
-
-  def status_porcelain():
-    out, _ = common.safe_git_call(
-        'status --porcelain -u --ignored {0}'.format(pathspecs))
-    for f_out in out.splitlines():
-      # Output is in the form <status> <file path>.
-      # <status> is 2 chars long.
-      fp, s = f_out[3:], f_out[:2]
-      if fp.startswith('"'):
-        fp = fp[1:-1]
-      if relative_paths:
-        fp = os.path.relpath(os.path.join(repo_dir, fp))
-      ret[fp] = s
-
-  def ls_files():
-    out, _ = common.safe_git_call(
-        'ls-files -v --full-name -- {0}'.format(pathspecs))
-    for f_out in common.remove_dups(out.splitlines(), lambda x: x[2:]):
-      fp, s = f_out[2:], f_out[0]
-      if relative_paths:
-        fp = os.path.relpath(os.path.join(repo_dir, fp))
-      if fp in ret:
-        ret[fp] = ret[fp] + s
-      else:
-        ret[fp] = '  ' + s
-
-  status_porcelain()
-  ls_files()
-  return common.items(ret)
-
-
-def au_files():
+  pathspecs = _pathspecs(only_paths, repo)
+  return _merge(
+      _status_porcelain(pathspecs, repo),
+      _ls_files(only_paths, pathspecs, repo), _fp_fixer(relative_paths, repo))
+
+
+def au_files(repo=None):
   """Assumed unchanged files."""
-  out, _ = common.safe_git_call('ls-files -v --full-name')
-  for f_out in common.remove_dups(out.splitlines(), lambda x: x[2:]):
-    if f_out[0] == 'h':
-      yield f_out[2:]
+  # Like ls-files with no pathspec, we only list the files under the cwd.
+  for fp, tag in _ls_files(['.'], '"."', repo):
+    if tag == 'h':
+      yield fp
+
+
+# Private functions.
+
+
+# Max total length of the paths given to one of call by of_files (to stay far
+# from ARG_MAX).
+_MAX_PATHSPECS_LEN = 65536
+
+
+def _chunks(fps):
+  chunk = []
+  chunk_len = 0
+  for fp in fps:
+    if chunk and chunk_len + len(fp) > _MAX_PATHSPECS_LEN:
+      yield chunk
+      chunk = []
+      chunk_len = 0
+    chunk.append(fp)
+    chunk_len += len(fp) + 3  # The quotes and space around it.
+  if chunk:
+    yield chunk
+
+
+def _of_root(only_paths, repo):
+  """Like of but the paths yielded are relative to the repo root."""
+  pathspecs = _pathspecs(only_paths, repo)
+  return _merge(
+      _status_porcelain(pathspecs, repo),
+      _ls_files(only_paths, pathspecs, repo), lambda fp: fp)
+
+
+def _pathspecs(only_paths, repo):
+  if only_paths:
+    return '"' + '" "'.join(only_paths) + '"'
+  return common.repo_dir(repo=repo)
+
+
+def _fp_fixer(relative_paths, repo):
+  if relative_paths:
+    repo_dir = common.repo_dir(repo=repo)
+    cwd = common.cwd(repo=repo)
+    return lambda fp: os.path.relpath(os.path.join(repo_dir, fp), cwd)
+  return lambda fp: fp
+
+
+def _merge(porcelain, ls_files, fix_fp):
+  """Combines the output of status porcelain with the ls-files tags.
+
+  Args:
+    porcelain: an iterable with the (fp, status) pairs of _status_porcelain.
+    ls_files: an iterable with the (fp, tag) pairs of _ls_files (only iterated
+      once porcelain is exhausted).
+    fix_fp: a function to apply to each path before yielding it.
+
+  Yields:
+    the (fp, status) pairs of of.
+  """
+  # Untracked and ignored files are not in the index so we can yield them right
+  # away. Tracked files need to be combined with their ls-files tag, there are
+  # usually only a few of them with changes so we keep those in memory and
+  # yield them as we go through ls-files.
+  changed = {}
+  for fp, s in porcelain:
+    if s == '??' or s == '!!':
+      # A file can be both a staged deletion and untracked, the latter wins.
+      changed.pop(fp, None)
+      yield fix_fp(fp), s
+    else:
+      changed[fp] = s
+
+  for fp, tag in ls_files:
+    yield fix_fp(fp), changed.pop(fp, '  ') + tag
+
+  # What's left are files that are no longer in the index (e.g., staged
+  # deletions).
+  for fp, s in common.items(changed):
+    yield fix_fp(fp), s
+
+
+_STATUS_CMD = 'status --porcelain=v2 -z -u --ignored -- {0}'
+
+
+def _status_porcelain(pathspecs, repo):
+  """Runs status porcelain v2.
+
+  Yields:
+    (fp, status) pairs. fp is relative to the repo root and status is the two
+    letter code of porcelain v1.
+  """
+  out = common.git_stream(
+      _STATUS_CMD.format(pathspecs), sep='\0', repo=repo)
+  return _parse_porcelain(out)
+
+
+def _parse_porcelain(entries):
+  """Parses the NUL-separated entries of status porcelain v2 (see
+  _status_porcelain)."""
+  out = iter(entries)
+  for entry in out:
+    t = entry[0]
+    if t == '1':
+      # 1 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <path>
+      parts = entry.split(' ', 8)
+      yield parts[8], _xy(parts[1])
+    elif t == '2':
+      # 2 <XY> <sub> <mH> <mI> <mW> <hH> <hI> <X><score> <path>, followed by
+      # an entry with the original path.
+      parts = entry.split(' ', 9)
+      next(out)
+      yield parts[9], _xy(parts[1])
+    elif t == 'u':
+      # u <XY> <sub> <m1> <m2> <m3> <mW> <h1> <h2> <h3> <path>
+      parts = entry.split(' ', 10)
+      yield parts[10], _xy(parts[1])
+    elif t == '?':
+      yield entry[2:], '??'
+    elif t == '!':
+      yield entry[2:], '!!'
+    elif t != '#':
+      raise common.UnexpectedOutputError('status', entry)
+
+
+def _xy(xy):
+  # Porcelain v2 uses '.' for unmodified, v1 uses a space.
+  return xy.replace('.', ' ')
+
+
+def _ls_files(only_paths, pathspecs, repo):
+  """Lists the files in the index with their ls-files -v tag.
+
+  The index is read in-process unless it uses features index.Index doesn't
+  support or only_paths has glob patterns, in which case we fall back to
+  running ls-files.
+
+  Yields:
+    (fp, tag) pairs. fp is relative to the repo root and tag is the one letter
+    status tag of ls-files -v.
+  """
+  idx = _read_index(only_paths, repo)
+  if idx:
+    with idx:
+      for fp, tag in _index_files(idx, only_paths, repo):
+        yield fp, tag
+    return
+
+  out = common.git_stream(
+      _LS_FILES_CMD.format(pathspecs), sep='\0', repo=repo)
+  for fp, tag in _parse_ls_files(out):
+    yield fp, tag
+
+
+_LS_FILES_CMD = 'ls-files -v -z --full-name -- {0}'
+
+
+def _parse_ls_files(out):
+  last_fp = None
+  for entry in out:
+    fp = entry[2:]
+    # Unmerged files have one (consecutive) entry per stage.
+    if fp != last_fp:
+      yield fp, entry[0]
+    last_fp = fp
+
+
+def _read_index(only_paths, repo):
+  """Returns the index.Index to list the files from or None if ls-files has to
+  be run instead."""
+  if only_paths and any(_GLOB_CHARS.search(p) for p in only_paths):
+    return None
+  try:
+    return git_index.read(repo=repo)
+  except git_index.UnsupportedIndexError:
+    return None
+
+
+_GLOB_CHARS = re.compile(r'[*?[\\]')
+
+
+def _index_files(idx, only_paths, repo):
+  matches = _matcher(only_paths, repo)
+  last_fp = None
+  for e in idx:
+    fp = e.path
+    # Unmerged files have one (consecutive) entry per stage.
+    if fp != last_fp and matches(fp):
+      yield fp, e.tag
+    last_fp = fp
+
+
+def _matcher(only_paths, repo):
+  """Returns a function that tells if a path is in only_paths.
+
+  The function takes a path relative to the repo root, only_paths are relative
+  to the cwd (or the path the repo was opened at).
+  """
+  if not only_paths:
+    return lambda fp: True
+
+  to_root = _root_relative(repo)
+  prefixes = []
+  for p in only_paths:
+    p = to_root(p)
+    prefixes.append('' if p == '.' else p)
+  return lambda fp: any(
+      not p or fp == p or fp.startswith(p + '/') for p in prefixes)
+
+
+def _root_relative(repo):
+  """Returns a function that converts a path relative to the cwd (or the path
+  the repo was opened at) or absolute to a path relative to the repo root."""
+  repo_dir = common.repo_dir(repo=repo)
+  cwd = common.cwd(repo=repo)
+  return lambda fp: os.path.relpath(os.path.join(cwd, fp), repo_dir)
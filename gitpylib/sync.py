@@ -19,7 +19,8 @@ NOTHING_TO_PUSH = 6
 PUSH_FAIL = 7
 
 
-def commit(files, msg, skip_checks=False, include_staged_files=False):
+def commit(
+    files, msg, skip_checks=False, include_staged_files=False, repo=None):
   """Record changes in the local repository.
 
   Args:
@@ -35,20 +36,21 @@ def commit(files, msg, skip_checks=False, include_staged_files=False):
   """
   cmd = 'commit {0}-m"{1}"'.format('--no-verify ' if skip_checks else '', msg)
   if not files and include_staged_files:
-    return common.safe_git_call(cmd)[0]
+    return common.safe_git_call(cmd, repo=repo)[0]
 
   return common.safe_git_call(
       '{0} {1}-- "{2}"'.format(
-          cmd, '-i ' if include_staged_files else '', '" "'.join(files)))[0]
+          cmd, '-i ' if include_staged_files else '', '" "'.join(files)),
+      repo=repo)[0]
 
 
-def merge(src):
+def merge(src, repo=None):
   """Merges changes in the src branch into the current branch.
 
   Args:
     src: the source branch to pick up changes from.
   """
-  ok, out, err = common.git_call('merge {0}'.format(src))
+  ok, out, err = common.git_call('merge {0}'.format(src), repo=repo)
   return _parse_merge_output(ok, out, err)
 
 
@@ -67,17 +69,17 @@ def _parse_merge_output(ok, out, err):
   return SUCCESS, None
 
 
-def abort_merge():
+def abort_merge(repo=None):
   """Aborts the current merge."""
-  common.safe_git_call('merge --abort')
+  common.safe_git_call('merge --abort', repo=repo)
 
 
-def merge_in_progress():
-  return os.path.exists(os.path.join(common.git_dir(), 'MERGE_HEAD'))
+def merge_in_progress(repo=None):
+  return os.path.exists(os.path.join(common.git_dir(repo=repo), 'MERGE_HEAD'))
 
 
-def rebase(new_base):
-  ok, out, err = common.git_call('rebase {0}'.format(new_base))
+def rebase(new_base, repo=None):
+  ok, out, err = common.git_call('rebase {0}'.format(new_base), repo=repo)
   return _parse_rebase_output(ok, out, err)
 
 
@@ -97,33 +99,33 @@ def _parse_rebase_output(ok, out, err):
   return SUCCESS, out
 
 
-def rebase_continue():
-  ok, out, _ = common.git_call('rebase --continue')
+def rebase_continue(repo=None):
+  ok, out, _ = common.git_call('rebase --continue', repo=repo)
   # print 'out is <%s>, err is <%s>' % (out, err)
   if not ok:
     return CONFLICT, None
   return SUCCESS, out
 
 
-def skip_rebase_commit():
-  ok, out, _ = common.git_call('rebase --skip')
+def skip_rebase_commit(repo=None):
+  ok, out, _ = common.git_call('rebase --skip', repo=repo)
   # print 'out is <%s>, err is <%s>' % (out, err)
   if not ok:
     return CONFLICT, None
   return SUCCESS, out
 
 
-def abort_rebase():
-  common.safe_git_call('rebase --abort')
+def abort_rebase(repo=None):
+  common.safe_git_call('rebase --abort', repo=repo)
 
 
-def rebase_in_progress():
-  return os.path.exists(os.path.join(common.git_dir(), 'rebase-apply'))
+def rebase_in_progress(repo=None):
+  return os.path.exists(os.path.join(common.git_dir(repo=repo), 'rebase-apply'))
 
 
-def push(src_branch, dst_remote, dst_branch):
+def push(src_branch, dst_remote, dst_branch, repo=None):
   _, _, err = common.git_call(
-      'push {0} {1}:{2}'.format(dst_remote, src_branch, dst_branch))
+      'push {0} {1}:{2}'.format(dst_remote, src_branch, dst_branch), repo=repo)
   if err == 'Everything up-to-date\n':
     return NOTHING_TO_PUSH, None
   elif ('Updates were rejected because a pushed branch tip is behind its remote'
@@ -133,12 +135,13 @@ def push(src_branch, dst_remote, dst_branch):
   return SUCCESS, err
 
 
-def pull_rebase(remote, remote_b):
+def pull_rebase(remote, remote_b, repo=None):
   ok, out, err = common.git_call(
-      'pull --rebase {0} {1}'.format(remote, remote_b))
+      'pull --rebase {0} {1}'.format(remote, remote_b), repo=repo)
   return _parse_rebase_output(ok, out, err)
 
 
-def pull_merge(remote, remote_b):
-  ok, out, err = common.git_call('pull {0} {1}'.format(remote, remote_b))
+def pull_merge(remote, remote_b, repo=None):
+  ok, out, err = common.git_call(
+      'pull {0} {1}'.format(remote, remote_b), repo=repo)
   return _parse_merge_output(ok, out, err)
@@ -0,0 +1,284 @@
+# gitpylib - a Python library for Git.
+# Licensed under GNU GPL v2.
+
+"""Module for watching the working tree of a repo for changes (Linux only).
+
+A Watcher keeps track of the paths that changed in the working tree using
+inotify. Like git's fsmonitor hook protocol, clients ask for the paths that
+changed since an opaque token and get back a new token to use in their next
+query (see status.Snapshot for how status uses it).
+"""
+
+
+import ctypes
+import ctypes.util
+import errno
+import itertools
+import os
+import select
+import struct
+import sys
+import threading
+
+from . import common
+from . import config
+
+
+# inotify_init1 flags.
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+# inotify events.
+_IN_MODIFY = 0x2
+_IN_ATTRIB = 0x4
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_DELETE = 0x200
+_IN_DELETE_SELF = 0x400
+_IN_Q_OVERFLOW = 0x4000
+_IN_IGNORED = 0x8000
+_IN_ONLYDIR = 0x1000000
+_IN_MASK_ADD = 0x20000000
+_IN_ISDIR = 0x40000000
+
+_WORK_TREE_MASK = (
+    _IN_MODIFY | _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO |
+    _IN_CREATE | _IN_DELETE | _IN_DELETE_SELF | _IN_ONLYDIR)
+# The dirs of the files that reset the watcher could also be watched as part
+# of the work tree, so we add to their mask instead of replacing it.
+_RESET_MASK = (
+    _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE | _IN_ONLYDIR |
+    _IN_MASK_ADD)
+
+# wd, mask, cookie, len.
+_EVENT = struct.Struct('iIII')
+
+# How often (in seconds) the watcher thread checks if it should stop.
+_POLL_SECS = 0.1
+
+# Used to tell apart tokens from different watchers.
+_watcher_ids = itertools.count(1)
+
+
+class UnsupportedError(Exception):
+  """Watching is not supported in this platform."""
+
+
+class Watcher(object):
+  """Watches the working tree of a repo for changes.
+
+  The watcher runs in a background thread, from the moment it is started until
+  it is stopped. It can also be used as a context manager.
+  """
+
+  def __init__(self, repo=None):
+    if not sys.platform.startswith('linux'):
+      raise UnsupportedError('watching requires inotify (Linux)')
+    self._repo = repo
+    self.root = common.repo_dir(repo=repo)
+    self.git_dir = common.git_dir(repo=repo)
+    self._id = '{0}.{1}'.format(os.getpid(), next(_watcher_ids))
+    self._lock = threading.Lock()
+    self._seq = 0
+    self._reset_seq = 0  # Everything changed as of this seq.
+    self._changes = {}  # fp -> seq of its last change.
+    self._wds = {}  # watch descriptor -> dir it watches (relative to root).
+    # Watch descriptor -> names of the files in the dir it watches whose changes
+    # make everything change (e.g., the index or the global excludes file).
+    self._reset_names = {}
+    self._failed = False
+    self._fd = None
+    self._thread = None
+    self._stop = threading.Event()
+
+  def start(self):
+    """Starts watching."""
+    libc = _libc()
+    fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+    if fd < 0:
+      raise _os_error()
+    self._fd = fd
+    self._failed = False
+    # Staging (by us or anyone else) changes the status of any file, and so
+    # does changing what's ignored.
+    self._reset_on(os.path.join(self.git_dir, 'index'))
+    self._reset_on(os.path.join(self.git_dir, 'info', 'exclude'))
+    self._reset_on(self._excludes_file())
+    self._add_tree('')
+    self._stop.clear()
+    self._thread = threading.Thread(target=self._run)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def stop(self):
+    """Stops watching."""
+    if self._thread:
+      self._stop.set()
+      self._thread.join()
+      self._thread = None
+    if self._fd is not None:
+      os.close(self._fd)
+      self._fd = None
+    self._wds.clear()
+    self._reset_names.clear()
+
+  def __enter__(self):
+    self.start()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.stop()
+
+  def token(self):
+    """Gets a token that represents the current point in time."""
+    with self._lock:
+      return self._token()
+
+  def changed_since(self, token):
+    """Gets the paths that changed since the given token.
+
+    Args:
+      token: a token previously returned by this watcher (or None).
+
+    Returns:
+      a pair (token, fps) where token is the token to use in the next query and
+      fps is a list of paths (relative to the repo root) that changed since the
+      given token or None if everything should be considered as changed (e.g.,
+      if the token is unknown, the index changed, ignore rules changed or the
+      watcher stopped working). Paths of dirs mean that anything under them
+      could have changed.
+    """
+    with self._lock:
+      new_token = self._token()
+      prefix = self._id + ':'
+      if self._failed or not token or not token.startswith(prefix):
+        return new_token, None
+      seq = int(token[len(prefix):])
+      if seq < self._reset_seq:
+        return new_token, None
+      return new_token, sorted(
+          fp for fp, fp_seq in common.items(self._changes) if fp_seq > seq)
+
+  def _token(self):
+    return '{0}:{1}'.format(self._id, self._seq)
+
+  def _run(self):
+    try:
+      self._watch()
+    except Exception:
+      # E.g., we ran out of inotify watches (ENOSPC) or couldn't watch a new
+      # dir (EACCES). We can't tell what changes from now on.
+      with self._lock:
+        self._failed = True
+
+  def _watch(self):
+    while not self._stop.is_set():
+      ready, _, _ = select.select([self._fd], [], [], _POLL_SECS)
+      if not ready:
+        continue
+      try:
+        buf = os.read(self._fd, 65536)
+      except OSError as e:
+        if e.errno == errno.EAGAIN:
+          continue
+        raise
+      self._process_events(buf)
+
+  def _process_events(self, buf):
+    i = 0
+    while i < len(buf):
+      wd, mask, _, name_len = _EVENT.unpack_from(buf, i)
+      i += _EVENT.size
+      name = common._decode(buf[i:i + name_len].rstrip(b'\0'))
+      i += name_len
+
+      if mask & _IN_Q_OVERFLOW:
+        # Events were lost.
+        self._reset()
+      elif name in self._reset_names.get(wd, ()):
+        self._reset()
+      elif mask & _IN_IGNORED:
+        self._wds.pop(wd, None)
+      elif wd in self._wds:
+        d = self._wds[wd]
+        fp = os.path.join(d, name) if d else name
+        if fp == '.git':
+          continue
+        if name == '.gitignore':
+          # It could change whether any file under d is ignored.
+          self._reset()
+          continue
+        if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+          # Dirs moved within the tree keep their watches, adding them again
+          # just updates the path they map to.
+          self._add_tree(fp)
+        self._changed(fp)
+
+  def _changed(self, fp):
+    with self._lock:
+      self._seq += 1
+      self._changes[fp] = self._seq
+
+  def _reset(self):
+    with self._lock:
+      self._seq += 1
+      self._reset_seq = self._seq
+      self._changes.clear()
+
+  def _add_tree(self, start):
+    for dirpath, dirnames, _ in os.walk(os.path.join(self.root, start)):
+      if '.git' in dirnames:
+        dirnames.remove('.git')
+      d = os.path.relpath(dirpath, self.root)
+      try:
+        wd = self._add_watch(dirpath, _WORK_TREE_MASK)
+      except OSError as e:
+        if e.errno in (errno.ENOENT, errno.ENOTDIR):
+          # Removed before we got to it.
+          continue
+        raise
+      self._wds[wd] = '' if d == '.' else d
+
+  def _reset_on(self, fp):
+    """Makes any change to the given file reset the watcher."""
+    if not fp:
+      return
+    d, name = os.path.split(fp)
+    if not os.path.isdir(d):
+      return
+    wd = self._add_watch(d, _RESET_MASK)
+    self._reset_names.setdefault(wd, set()).add(name)
+
+  def _excludes_file(self):
+    fp = config.get('core.excludesFile', repo=self._repo)
+    if not fp:
+      xdg = os.environ.get('XDG_CONFIG_HOME') or os.path.join('~', '.config')
+      fp = os.path.join(xdg, 'git', 'ignore')
+    return os.path.expanduser(fp)
+
+  def _add_watch(self, path, mask):
+    # Python 2/3 compatibility.
+    if sys.version > '3':
+      path = path.encode('utf-8')
+    wd = _libc().inotify_add_watch(self._fd, path, mask)
+    if wd < 0:
+      raise _os_error()
+    return wd
+
+
+_libc_handle = None
+
+
+def _libc():
+  global _libc_handle
+  if not _libc_handle:
+    _libc_handle = ctypes.CDLL(
+        ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+  return _libc_handle
+
+
+def _os_error():
+  e = ctypes.get_errno()
+  return OSError(e, os.strerror(e))